@@ -46,6 +46,7 @@ CREATE TABLE IF NOT EXISTS obra_tecnologia (
     obra_id INTEGER NOT NULL,
     tecnologia_id INTEGER NOT NULL,
     PRIMARY KEY (id),
+    UNIQUE (obra_id, tecnologia_id),
     FOREIGN KEY (obra_id)
         REFERENCES obra(id)
         ON UPDATE CASCADE
@@ -72,6 +73,26 @@ CREATE TABLE IF NOT EXISTS tematica_contenida (
     CHECK (tematica_padre_id <> tematica_hijo_id)
 );
 
+-- databases created before the (obra_id, tecnologia_id) key: drop duplicate links, then add it
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'obra_tecnologia_obra_id_tecnologia_id_key') THEN
+        DELETE FROM obra_tecnologia a USING obra_tecnologia b
+        WHERE a.obra_id = b.obra_id AND a.tecnologia_id = b.tecnologia_id AND a.id > b.id;
+        ALTER TABLE obra_tecnologia
+            ADD CONSTRAINT obra_tecnologia_obra_id_tecnologia_id_key UNIQUE (obra_id, tecnologia_id);
+    END IF;
+END $$;
+
+-- per-row content hash written by csv_to_sql --sync, used to send only changed rows
+CREATE TABLE IF NOT EXISTS load_state (
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    row_hash BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, row_id)
+);
+
 CREATE INDEX IF NOT EXISTS idx_obra_tematica ON obra(tematica_id);
 CREATE INDEX IF NOT EXISTS idx_obratec_tecnologia ON obra_tecnologia(tecnologia_id);
 CREATE INDEX IF NOT EXISTS idx_tematica_hijo ON tematica_contenida(tematica_hijo_id);
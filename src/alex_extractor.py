@@ -1,23 +1,37 @@
-import requests
-import csv
-import time
 import os
+import argparse
+import threading
+import json
+import timeit
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import http_client
+import cache_store
+from keywords import KEYWORDS
 
 BASE_URL = "https://api.openalex.org/works"
 PER_PAGE = 200
-KEYWORDS = [
-    "python","c-programming-language","javascript","java","java-programming-language",
-    "sql","dart","swift","cobol","fortran","matlab","prolog","lisp","haskell","rust","perl",
-    "scala","html","html5"
-]
 SUBFIELD_ID = "subfields/1702"
 LANGUAGE = "languages/en"
+WORK_FILTER = f"open_access.is_oa:true,has_content.pdf:true,primary_topic.subfield.id:{SUBFIELD_ID},best_oa_location.is_accepted:true,language:{LANGUAGE},keywords.id:{'|'.join(KEYWORDS)}"
+MAX_REQUESTS_PER_SECOND = 10  # OpenAlex polite pool limit
+MAX_CONCURRENT_REQUESTS = 8
+OPENALEX_API_KEY = os.environ.get("OPENALEX_API_KEY")  # from_updated_date needs a premium key
+DEFAULT_WORKERS = 1
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # go up one level from src/
 CACHE_DIR = os.path.join(BASE_DIR, "cache")
 
-CSV_OBRA = os.path.join(CACHE_DIR, "obra.csv")
-CSV_TEMATICA = os.path.join(CACHE_DIR, "tematica.csv")
-CSV_TEMATICA_CONTENIDA = os.path.join(CACHE_DIR, "tematica_contenida.csv")
+OBRA_TABLE = "obra"
+TEMATICA_TABLE = "tematica"
+TEMATICA_CONTENIDA_TABLE = "tematica_contenida"
+CHECKPOINT_FILE = os.path.join(CACHE_DIR, "harvest_checkpoint.json")
+SYNC_STATE_FILE = os.path.join(CACHE_DIR, "harvest_state.json")
+
+OBRA_FIELDS = [
+    "id","direccion_fuente","titulo","abstract","fecha_publicacion",
+    "idioma","num_citas","fwci","tematica_id","doi","openalex_id"
+]
 
 os.makedirs(CACHE_DIR, exist_ok=True)
 
@@ -32,117 +46,294 @@ def reconstruct_abstract(abstract_inverted_index):
             position_map[pos] = word
     return " ".join(position_map[pos] for pos in sorted(position_map.keys()))
 
-def fetch_page(url, params, max_retries=5, delay_base=2):
-    retries = 0
-    while retries < max_retries:
-        try:
-            response = requests.get(url, params=params, timeout=30)
-            if response.status_code == 200:
-                return response.json()
-            print(f"⚠️ Warning: Bad response {response.status_code}, retrying...")
-        except Exception as e:
-            print(f"⚠️ Warning: Exception during request: {e}")
-        retries += 1
-        time.sleep(delay_base ** retries)
+def reconstruct_abstracts(abstract_inverted_indexes):
+    """
+    Reconstruct a whole page of abstracts.
+    OpenAlex positions are dense (0..n-1), so each abstract is scattered into a
+    preallocated list of n slots and joined without sorting; indexes with gaps
+    or positions outside 0..n-1 fall back to reconstruct_abstract.
+    """
+    abstracts = []
+    for index in abstract_inverted_indexes:
+        if not index or not isinstance(index, dict):
+            abstracts.append("")
+            continue
+        slots = [None] * sum(map(len, index.values()))
+        dense = True
+        for word, positions in index.items():
+            for pos in positions:
+                # checked explicitly: slots[-1] would silently write the last slot
+                if not 0 <= pos < len(slots):
+                    dense = False
+                    break
+                slots[pos] = word
+            if not dense:
+                break
+        if not dense or None in slots:
+            abstracts.append(reconstruct_abstract(index))
+        else:
+            abstracts.append(" ".join(slots))
+    return abstracts
+
+http_client.configure_host("api.openalex.org", MAX_REQUESTS_PER_SECOND, MAX_CONCURRENT_REQUESTS)
+
+def fetch_page(url, params, max_retries=5):
+    if OPENALEX_API_KEY:
+        params = {**params, "api_key": OPENALEX_API_KEY}
+    try:
+        response = http_client.get(url, params=params, timeout=30, max_retries=max_retries)
+        if response.status_code == 200:
+            return response.json()
+        print(f"⚠️ Warning: Bad response {response.status_code}.")
+    except Exception as e:
+        print(f"⚠️ Warning: Exception during request: {e}")
     print(f"❌ Error: Failed to fetch page after {max_retries} retries.")
     return None
 
 def initialize_csv_files():
-    os.makedirs(os.path.dirname(CSV_OBRA), exist_ok=True)
-    with open(CSV_OBRA, "w", newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "id","direccion_fuente","titulo","abstract","fecha_publicacion",
-            "idioma","num_citas","fwci","tematica_id","doi"
-        ])
-    print(f"Initialized '{CSV_OBRA}' for writing works.")
-
-def fetch_all_works():
-    tematica_map = {}
-    next_tematica_id = 1
-    obra_id = 1
-    page = 1
-    total_results = None
-
-    while True:
+    cache_store.init_table(OBRA_TABLE, OBRA_FIELDS)
+    print(f"Initialized '{cache_store.table_path(OBRA_TABLE)}' for writing works.")
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class HarvestState:
+    """Ids, topics and per-shard cursors shared between the shards of one harvest."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tematica_map = {}
+        self.next_tematica_id = 1
+        self.obra_id = 1
+        self.obra_mark = 0
+        self.shards = {}
+        self.started_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def add_shard(self, label, filter_str):
+        self.shards[label] = {"filter": filter_str, "cursor": "*", "page": 0, "done": False}
+
+    def save_checkpoint(self):
+        write_json_atomic(CHECKPOINT_FILE, {
+            "obra_id": self.obra_id,
+            "obra_mark": self.obra_mark,
+            "next_tematica_id": self.next_tematica_id,
+            "tematica_map": self.tematica_map,
+            "shards": self.shards,
+            "started_at": self.started_at,
+        })
+
+    @classmethod
+    def load_checkpoint(cls):
+        with open(CHECKPOINT_FILE, encoding='utf-8') as f:
+            data = json.load(f)
+        state = cls()
+        state.obra_id = data["obra_id"]
+        state.obra_mark = data["obra_mark"]
+        state.next_tematica_id = data["next_tematica_id"]
+        state.tematica_map = data["tematica_map"]
+        state.shards = data["shards"]
+        state.started_at = data["started_at"]
+        return state
+
+def build_obra_row(work, state, obra_id=None, abstract=None):
+    # --- PDF URL ---
+    pdf_url = (work.get("best_oa_location") or {}).get("pdf_url")
+    if not pdf_url:
+        return None
+
+    # --- DOI ---
+    doi = work.get("doi", "")
+
+    titulo = work.get("title", "")
+    if abstract is None:
+        abstract = reconstruct_abstract(work.get("abstract_inverted_index"))
+    fecha_publicacion = work.get("publication_date", "")
+    idioma = work.get("language", LANGUAGE)
+    num_citas = work.get("cited_by_count", 0)
+    fwci = work.get("fwci", "")
+    primary_topic = work.get("primary_topic")
+    if not primary_topic:
+        return None
+    topic_name = primary_topic.get("display_name", "Unknown Topic")
+    if topic_name not in state.tematica_map:
+        state.tematica_map[topic_name] = state.next_tematica_id
+        state.next_tematica_id += 1
+    tematica_id = state.tematica_map[topic_name]
+
+    if obra_id is None:
+        obra_id = state.obra_id
+        state.obra_id += 1
+    return [
+        obra_id, pdf_url, titulo, abstract, fecha_publicacion,
+        idioma, num_citas, fwci, tematica_id, doi, work.get("id", "")
+    ]
+
+def write_works(works, state, label, next_cursor):
+    """Append one page of works and checkpoint, so a crash loses at most this page."""
+    with state.lock:
+        abstracts = reconstruct_abstracts([work.get("abstract_inverted_index") for work in works])
+        rows = [build_obra_row(work, state, abstract=abstract) for work, abstract in zip(works, abstracts)]
+        state.obra_mark = cache_store.append_rows(OBRA_TABLE, OBRA_FIELDS, [row for row in rows if row])
+        shard = state.shards[label]
+        shard["cursor"] = next_cursor
+        shard["page"] += 1
+        shard["done"] = not next_cursor
+        state.save_checkpoint()
+
+def harvest_shard(state, label, sink=write_works):
+    """Walk one shard with cursor pagination, which has no deep-paging limit."""
+    shard = state.shards[label]
+    cursor = shard["cursor"]
+    page = shard["page"]
+    while cursor:
         params = {
-            "page": page,
+            "cursor": cursor,
             "per_page": PER_PAGE,
-            "filter": f"open_access.is_oa:true,has_content.pdf:true,primary_topic.subfield.id:{SUBFIELD_ID},best_oa_location.is_accepted:true,language:{LANGUAGE},keywords.id:{'|'.join(KEYWORDS)}",
+            "filter": shard["filter"],
             "sort": "cited_by_count:desc"
         }
         data = fetch_page(BASE_URL, params)
         if not data or "results" not in data:
-            print(f"No data returned for page {page}, stopping.")
+            print(f"[{label}] No data returned for page {page + 1}, stopping.")
             break
 
         works = data["results"]
-        if total_results is None:
-            total_results = data.get("meta", {}).get("count", 0)
-            print(f"Total results to fetch (approximate): {total_results}")
-
-        print(f"Fetched page {page} with {len(works)} works.")
-
-        with open(CSV_OBRA, "a", newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            for work in works:
-                # --- PDF URL ---
-                pdf_url = work.get("best_oa_location", {}).get("pdf_url")
-                if not pdf_url:
-                    continue
-
-                # --- DOI ---
-                doi = work.get("doi", "")
-
-                titulo = work.get("title", "")
-                abstract = reconstruct_abstract(work.get("abstract_inverted_index"))
-                fecha_publicacion = work.get("publication_date", "")
-                idioma = work.get("language", LANGUAGE)
-                num_citas = work.get("cited_by_count", 0)
-                fwci = work.get("fwci", "")
-                primary_topic = work.get("primary_topic")
-                if not primary_topic:
-                    continue
-                topic_name = primary_topic.get("display_name", "Unknown Topic")
-                if topic_name not in tematica_map:
-                    tematica_map[topic_name] = next_tematica_id
-                    next_tematica_id += 1
-                tematica_id = tematica_map[topic_name]
-
-                writer.writerow([
-                    obra_id, pdf_url, titulo, abstract, fecha_publicacion,
-                    idioma, num_citas, fwci, tematica_id, doi
-                ])
-                obra_id += 1
-
-        if page * PER_PAGE >= total_results or not works:
-            break
         page += 1
+        if page == 1:
+            print(f"[{label}] Total results to fetch (approximate): {data.get('meta', {}).get('count', 0)}")
+        print(f"[{label}] Fetched page {page} with {len(works)} works.")
+
+        cursor = data.get("meta", {}).get("next_cursor") if works else None
+        sink(works, state, label, cursor)
+
+def list_year_shards(filter_str):
+    """Split the filter into disjoint publication-year shards, biggest first."""
+    data = fetch_page(BASE_URL, {"filter": filter_str, "group_by": "publication_year"})
+    if not data or "group_by" not in data:
+        return []
+    shards = [(g["key"], g.get("count", 0)) for g in data["group_by"]]
+    return sorted(shards, key=lambda s: s[1], reverse=True)
 
-    print(f"Finished fetching all works. Total works saved: {obra_id-1}")
-    return tematica_map
+def fetch_all_works(workers=DEFAULT_WORKERS, state=None):
+    if state is None:
+        state = HarvestState()
+        state.obra_mark = cache_store.table_mark(OBRA_TABLE)
+        shards = list_year_shards(WORK_FILTER) if workers > 1 else []
+        if shards:
+            print(f"Harvesting {len(shards)} year shards with {workers} workers "
+                  f"({sum(count for _, count in shards)} results approx.)")
+            for year, _ in shards:
+                state.add_shard(year, f"{WORK_FILTER},publication_year:{year}")
+        else:
+            state.add_shard("all", WORK_FILTER)
+        state.save_checkpoint()
+
+    pending = [label for label, shard in state.shards.items() if not shard["done"]]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(harvest_shard, state, label): label for label in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Error: Shard {futures[future]} failed: {e}")
+
+    unfinished = [label for label, shard in state.shards.items() if not shard["done"]]
+    if unfinished:
+        print(f"⚠️ Warning: {len(unfinished)} shard(s) did not finish, rerun with --resume.")
+    print(f"Finished fetching all works. Total works saved: {state.obra_id-1}")
+    return state
+
+def resume_harvest_state():
+    """Load the checkpoint and drop any rows written after it was taken."""
+    if not os.path.exists(CHECKPOINT_FILE):
+        return None
+    state = HarvestState.load_checkpoint()
+    cache_store.rollback(OBRA_TABLE, state.obra_mark)
+    done = sum(shard["done"] for shard in state.shards.values())
+    print(f"Resuming harvest at obra_id={state.obra_id} ({done}/{len(state.shards)} shards done).")
+    return state
+
+def load_sync_state():
+    if not os.path.exists(SYNC_STATE_FILE):
+        return {}
+    with open(SYNC_STATE_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_sync_state(started_at):
+    write_json_atomic(SYNC_STATE_FILE, {"last_harvest": started_at})
+
+def load_tematica_map():
+    if not cache_store.table_exists(TEMATICA_TABLE):
+        return {}
+    return {row["nombre_campo"].strip(): int(row["id"]) for row in cache_store.read_rows(TEMATICA_TABLE)}
+
+def sync_updated_works(since):
+    """Fetch works updated since `since` and upsert them into the obra table, keeping obra ids."""
+    rows = list(cache_store.read_rows(OBRA_TABLE))
+    index = {}
+    for pos, row in enumerate(rows):
+        for key in (row.get("openalex_id"), row.get("doi")):
+            if key:
+                index[key] = pos
+
+    state = HarvestState()
+    state.tematica_map = load_tematica_map()
+    state.next_tematica_id = max(state.tematica_map.values(), default=0) + 1
+    state.obra_id = max((int(r["id"]) for r in rows), default=0) + 1
+    state.add_shard("delta", f"{WORK_FILTER},from_updated_date:{since}")
+
+    updated = []
+    def collect(works, state, label, next_cursor):
+        updated.extend(works)
+        state.shards[label]["cursor"] = next_cursor
+        state.shards[label]["done"] = not next_cursor
+
+    harvest_shard(state, "delta", sink=collect)
+    if not state.shards["delta"]["done"]:
+        print("❌ Error: Delta sync did not finish, obra table left untouched.")
+        return None
+
+    inserted = changed = 0
+    abstracts = reconstruct_abstracts([work.get("abstract_inverted_index") for work in updated])
+    for work, abstract in zip(updated, abstracts):
+        key = work.get("id") if work.get("id") in index else work.get("doi")
+        pos = index.get(key)
+        obra_id = int(rows[pos]["id"]) if pos is not None else None
+        values = build_obra_row(work, state, obra_id=obra_id, abstract=abstract)
+        if not values:
+            continue
+        row = dict(zip(OBRA_FIELDS, values))
+        if pos is None:
+            index[row["openalex_id"] or row["doi"]] = len(rows)
+            rows.append(row)
+            inserted += 1
+        else:
+            rows[pos] = row
+            changed += 1
+
+    cache_store.write_rows(OBRA_TABLE, OBRA_FIELDS, rows, rows_per_group=PER_PAGE)
+    print(f"Delta sync since {since}: {inserted} new and {changed} updated works.")
+    return state
 
 def save_tematica_csv(tematica_map):
-    os.makedirs(os.path.dirname(CSV_TEMATICA), exist_ok=True)
-    with open(CSV_TEMATICA, "w", newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["id","nombre_campo"])
-        for topic_name, topic_id in tematica_map.items():
-            writer.writerow([topic_id, topic_name])
-    print(f"Saved '{CSV_TEMATICA}' with {len(tematica_map)} topics.")
+    rows = [{"id": topic_id, "nombre_campo": topic_name} for topic_name, topic_id in tematica_map.items()]
+    cache_store.write_rows(TEMATICA_TABLE, ["id", "nombre_campo"], rows)
+    print(f"Saved '{cache_store.table_path(TEMATICA_TABLE)}' with {len(tematica_map)} topics.")
 
 def update_tematica_and_generate_contenida():
-    if not os.path.exists(CSV_TEMATICA):
-        raise FileNotFoundError(f"{CSV_TEMATICA} not found.")
+    if not cache_store.table_exists(TEMATICA_TABLE):
+        raise FileNotFoundError(f"{cache_store.table_path(TEMATICA_TABLE)} not found.")
 
     tematicas = {}
     rows = []
-    with open(CSV_TEMATICA, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            row["id"] = int(row["id"])
-            rows.append(row)
-            tematicas[row["nombre_campo"].strip()] = row["id"]
+    for row in cache_store.read_rows(TEMATICA_TABLE):
+        row["id"] = int(row["id"])
+        rows.append(row)
+        tematicas[row["nombre_campo"].strip()] = row["id"]
 
     max_id = max(r["id"] for r in rows)
     for topic in BASE_TOPICS:
@@ -152,10 +343,7 @@ def update_tematica_and_generate_contenida():
             rows.append({"id": max_id, "nombre_campo": topic})
             print(f"Added base topic '{topic}' with id={max_id}")
 
-    with open(CSV_TEMATICA, "w", newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=["id", "nombre_campo"])
-        writer.writeheader()
-        writer.writerows(rows)
+    cache_store.write_rows(TEMATICA_TABLE, ["id", "nombre_campo"], rows)
 
     relaciones = [
         {"id_padre": tematicas["Physical Sciences"], "id_hijo": tematicas["Computer Science"]},
@@ -165,23 +353,88 @@ def update_tematica_and_generate_contenida():
     for nombre, id_ in tematicas.items():
         if nombre not in BASE_TOPICS:
             relaciones.append({"id_padre": ai_id, "id_hijo": id_})
-    relaciones = [{"id_padre": p, "id_hijo": h} for p, h in {(r["id_padre"], r["id_hijo"]) for r in relaciones}]
+    relaciones = [{"id_padre": p, "id_hijo": h} for p, h in sorted({(r["id_padre"], r["id_hijo"]) for r in relaciones})]
+    cache_store.write_rows(TEMATICA_CONTENIDA_TABLE, ["id_padre", "id_hijo"], relaciones)
+
+    print(f"'{cache_store.table_path(TEMATICA_TABLE)}' updated with {len(rows)} topics.")
+    print(f"'{cache_store.table_path(TEMATICA_CONTENIDA_TABLE)}' generated with {len(relaciones)} relations.")
 
-    os.makedirs(os.path.dirname(CSV_TEMATICA_CONTENIDA), exist_ok=True)
-    with open(CSV_TEMATICA_CONTENIDA, "w", newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=["id_padre", "id_hijo"])
-        writer.writeheader()
-        writer.writerows(relaciones)
+def benchmark_abstracts(pages=3, repeat=7):
+    """Compare reconstruct_abstract with reconstruct_abstracts on real OpenAlex pages."""
+    cursor = "*"
+    batches = []
+    while cursor and len(batches) < pages:
+        data = fetch_page(BASE_URL, {
+            "cursor": cursor, "per_page": PER_PAGE, "filter": WORK_FILTER,
+            "select": "id,abstract_inverted_index"
+        })
+        if not data or not data.get("results"):
+            break
+        batches.append([work.get("abstract_inverted_index") for work in data["results"]])
+        cursor = data.get("meta", {}).get("next_cursor")
+    if not batches:
+        print("❌ Error: Could not fetch any pages to benchmark.")
+        return
 
-    print(f"'{CSV_TEMATICA}' updated with {len(rows)} topics.")
-    print(f"'{CSV_TEMATICA_CONTENIDA}' generated with {len(relaciones)} relations.")
+    for batch in batches:
+        assert reconstruct_abstracts(batch) == [reconstruct_abstract(i) for i in batch]
+    single = min(timeit.repeat(lambda: [[reconstruct_abstract(i) for i in b] for b in batches], number=1, repeat=repeat))
+    batched = min(timeit.repeat(lambda: [reconstruct_abstracts(b) for b in batches], number=1, repeat=repeat))
+    print(f"reconstruct_abstract:  {single / len(batches) * 1000:.2f} ms/page")
+    print(f"reconstruct_abstracts: {batched / len(batches) * 1000:.2f} ms/page ({single / batched:.2f}x)")
 
 def main():
+    parser = argparse.ArgumentParser(description="Harvest OpenAlex works into cache/.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="concurrent year shards to harvest (1 = single cursor walk)")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"continue from {os.path.basename(CHECKPOINT_FILE)} instead of starting over")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch works updated since the last successful harvest")
+    parser.add_argument("--since", help="override the last harvest date for --incremental (YYYY-MM-DD)")
+    parser.add_argument("--benchmark-abstracts", action="store_true",
+                        help="time abstract reconstruction on a few real pages and exit")
+    args = parser.parse_args()
+
+    if args.benchmark_abstracts:
+        benchmark_abstracts()
+        return
+
+    cache_store.recover_tables()
+
+    if args.incremental:
+        if os.path.exists(CHECKPOINT_FILE):
+            # until that harvest finishes the obra table is partial, and resuming it appends after the delta
+            print(f"❌ Error: An unfinished harvest is checkpointed in '{CHECKPOINT_FILE}'. "
+                  "Finish it with --resume (or delete the checkpoint) before running --incremental.")
+            return
+        since = args.since or load_sync_state().get("last_harvest")
+        if not since or not cache_store.table_exists(OBRA_TABLE):
+            print("❌ Error: No previous harvest to sync from, run a full harvest first.")
+            return
+        print(f"Starting OpenAlex delta sync from {since}...")
+        state = sync_updated_works(since)
+        if state is None:
+            return
+        save_tematica_csv(state.tematica_map)
+        update_tematica_and_generate_contenida()
+        save_sync_state(state.started_at)
+        print("Finished syncing updated works and topics.")
+        return
+
     print("Starting OpenAlex fetch process...")
-    initialize_csv_files()
-    tematica_map = fetch_all_works()
-    save_tematica_csv(tematica_map)
+    state = resume_harvest_state() if args.resume else None
+    if state is None:
+        if args.resume:
+            print("No checkpoint found, starting a fresh harvest.")
+        initialize_csv_files()
+    state = fetch_all_works(workers=args.workers, state=state)
+    if any(not shard["done"] for shard in state.shards.values()):
+        return
+    save_tematica_csv(state.tematica_map)
     update_tematica_and_generate_contenida()
+    os.remove(CHECKPOINT_FILE)
+    save_sync_state(state.started_at)
     print("Finished fetching and processing all works and topics.")
 
 if __name__ == "__main__":
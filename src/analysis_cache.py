@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYSIS_CACHE_FILE = os.path.join(BASE_DIR, "cache", "analysis.sqlite")
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def prompt_version(prompt):
+    """Short hash of the prompt template, so editing the prompt invalidates old answers."""
+    return text_hash(prompt)[:12]
+
+class AnalysisCache:
+    """Persistent LLM answers keyed by (text hash, model, prompt version)."""
+    def __init__(self, path=ANALYSIS_CACHE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS analysis (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (text_hash, model, prompt_version)
+            )
+        """)
+        self.db.commit()
+
+    def get(self, digest, model, version):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result FROM analysis WHERE text_hash = ? AND model = ? AND prompt_version = ?",
+                (digest, model, version)
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return json.loads(row[0])
+            self.misses += 1
+            return None
+
+    def put(self, digest, model, version, result):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO analysis (text_hash, model, prompt_version, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, model, version, json.dumps(result), time.time())
+            )
+            self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
@@ -0,0 +1,244 @@
+import csv
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for CACHE_FORMAT=parquet
+    pa = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+
+# "csv" (default) or "parquet"; only tables in COLUMNAR_TABLES are ever written as Parquet,
+# the small lookup tables stay CSV so they can still be read and edited by hand.
+CACHE_FORMAT = os.environ.get("CACHE_FORMAT", "csv").lower()
+COLUMNAR_TABLES = {"obra"}
+
+# Parquet column types; anything not listed is stored as a string.
+COLUMN_TYPES = {
+    "id": "int",
+    "num_citas": "int",
+    "fwci": "float",
+    "tematica_id": "int",
+    "obra_id": "int",
+    "tecnologia_id": "int",
+}
+
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+def table_format(name):
+    return "parquet" if CACHE_FORMAT == "parquet" and name in COLUMNAR_TABLES else "csv"
+
+def table_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.{table_format(name)}")
+
+def recover_table(name):
+    """Put back a Parquet table that write_rows moved aside but never replaced (crash between its renames)."""
+    path = table_path(name)
+    if not os.path.exists(path) and os.path.exists(f"{path}.old"):
+        os.replace(f"{path}.old", path)
+        print(f"♻️ Restored '{path}' after an interrupted rewrite.")
+
+def recover_tables():
+    """Startup check of every table write_rows may have left mid-swap."""
+    for name in COLUMNAR_TABLES:
+        recover_table(name)
+
+def table_exists(name):
+    return os.path.exists(table_path(name))
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("CACHE_FORMAT=parquet needs pyarrow (pip install pyarrow).")
+
+def arrow_schema(fields):
+    types = {"int": pa.int64(), "float": pa.float64()}
+    return pa.schema([(f, types.get(COLUMN_TYPES.get(f), pa.string())) for f in fields])
+
+def to_arrow(fields, rows):
+    """Rows (lists or dicts) -> Arrow table, mapping '' to null for typed columns."""
+    columns = {f: [] for f in fields}
+    for row in rows:
+        values = row if isinstance(row, dict) else dict(zip(fields, row))
+        for f in fields:
+            value = values.get(f)
+            kind = COLUMN_TYPES.get(f)
+            if value is None or (value == "" and kind):
+                value = None
+            elif kind == "int":
+                value = int(value)
+            elif kind == "float":
+                value = float(value)
+            else:
+                value = str(value)
+            columns[f].append(value)
+    return pa.table(columns, schema=arrow_schema(fields))
+
+def part_seqs(path):
+    return sorted(int(p[5:-8]) for p in os.listdir(path) if p.startswith("part-") and p.endswith(".parquet"))
+
+def write_part(path, seq, table):
+    part = os.path.join(path, f"part-{seq:06d}.parquet")
+    pq.write_table(table, f"{part}.tmp")
+    os.replace(f"{part}.tmp", part)
+
+def init_table(name, fields):
+    """Create an empty table, replacing any previous contents."""
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return
+    with open(path, "w", newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(fields)
+
+def table_mark(name):
+    """Opaque position of the end of the table, for rollback()."""
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        return max(part_seqs(path), default=0)
+    return os.path.getsize(path)
+
+def append_rows(name, fields, rows):
+    """
+    Durably append a batch of rows (one CSV write or one Parquet part file)
+    and return the new table_mark.
+    """
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        seq = table_mark(name) + 1
+        write_part(path, seq, to_arrow(fields, rows))
+        return seq
+    with open(path, "a", newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([row.get(k, "") for k in fields] if isinstance(row, dict) else row)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+def repair_tail(name):
+    """
+    Make a CSV end on a row boundary again after a crash. An unterminated
+    last row that parses as a full row is kept and terminated; one that
+    ends inside a quoted field, or has a different number of fields than
+    the header, was cut off mid-write and is dropped.
+    """
+    path = table_path(name)
+    if table_format(name) != "csv" or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        content = f.read()
+        # the last row starts after the last newline that is not inside a quoted field
+        start = content.rfind(b"\n")
+        while start != -1 and content.count(b'"', 0, start) % 2:
+            start = content.rfind(b"\n", 0, start)
+        start += 1
+        tail = content[start:]
+        header = next(csv.reader([content.split(b"\n", 1)[0].decode("utf-8")]))
+        try:
+            fields = next(csv.reader([tail.decode("utf-8").rstrip("\r")], strict=True))
+            complete = tail.count(b'"') % 2 == 0 and len(fields) == len(header)
+        except (csv.Error, UnicodeDecodeError):
+            complete = False
+        if complete:
+            f.write(b"\n" if tail.endswith(b"\r") else b"\r\n")
+        else:
+            f.truncate(start)
+            print(f"✂️ Dropped a partial last row from '{path}'.")
+
+def next_id(name):
+    """One past the largest integer id in the table (1 when it is empty or missing)."""
+    if not table_exists(name):
+        return 1
+    ids = []
+    for row in read_rows(name, columns=["id"]):
+        try:
+            ids.append(int(row["id"]))
+        except (TypeError, ValueError):
+            continue
+    return max(ids, default=0) + 1
+
+def rollback(name, mark):
+    """Drop everything appended after `mark`."""
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        for seq in part_seqs(path):
+            if seq > mark:
+                os.remove(os.path.join(path, f"part-{seq:06d}.parquet"))
+        return
+    with open(path, "r+b") as f:
+        f.truncate(mark)
+
+def write_rows(name, fields, rows, rows_per_group=200):
+    """
+    Replace the whole table. A CSV table is replaced atomically; a Parquet
+    directory is moved aside before the new one is renamed in, and
+    recover_table() puts it back if that second rename never happened.
+    """
+    recover_table(name)
+    path = table_path(name)
+    tmp_path = f"{path}.tmp"
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        pq.write_table(to_arrow(fields, rows), os.path.join(tmp_path, "part-000001.parquet"),
+                       row_group_size=rows_per_group)
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return
+    with open(tmp_path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval="", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+def read_rows(name, columns=None):
+    """
+    Stream rows as dicts. With Parquet only `columns` are decoded; CSV values
+    are strings and typed Parquet values come back as int/float/None.
+    """
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        dataset = ds.dataset(path, format="parquet")
+        for batch in dataset.to_batches(columns=columns):
+            yield from batch.to_pylist()
+        return
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {c: row.get(c) for c in columns} if columns else row
+
+def read_dataframe_chunks(name, chunksize, columns=None):
+    """Yield the table as dataframes of at most `chunksize` rows."""
+    import pandas as pd
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        dataset = ds.dataset(path, format="parquet")
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+def read_dataframe(name, columns=None):
+    import pandas as pd
+    path = table_path(name)
+    if table_format(name) == "parquet":
+        require_pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
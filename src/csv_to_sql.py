@@ -1,6 +1,17 @@
+import io
 import os
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+import cache_store
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db"))
+import create_db
 
 DB_PARAMS = {
     "host": "localhost",
@@ -9,90 +20,274 @@ DB_PARAMS = {
     "user": "userPSQL",
     "password": "passPSQL"
 }
+CHUNK_SIZE = 5000  # rows per COPY buffer and per commit
+LOAD_WORKERS = 3
+SCHEMA_TABLE_RE = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", re.S)
 
-def main():
-    connection = psycopg2.connect(**DB_PARAMS)
+# link tables: one row per natural key, whatever ids the cache gave them
+NATURAL_KEYS = {"obra_tecnologia": ["obra_id", "tecnologia_id"]}
+# unique columns besides id: an upsert that would take another row's value is skipped and reported
+UNIQUE_COLUMNS = {"obra": ["doi"]}
+
+# table -> [(cache column, db column, kind)]; load order comes from the schema's foreign keys.
+# kind: "int" / "text" map missing values to NULL, "count" / "metric" default them to 0.
+TABLE_COLUMNS = {
+    "tematica": [
+        ("id", "id", "int"),
+        ("nombre_campo", "nombre_campo", "text"),
+    ],
+    "tematica_contenida": [
+        ("id", "id", "int"),
+        ("id_padre", "tematica_padre_id", "int"),
+        ("id_hijo", "tematica_hijo_id", "int"),
+    ],
+    "obra": [
+        ("id", "id", "int"),
+        ("doi", "doi", "text"),
+        ("direccion_fuente", "direccion_fuente", "text"),
+        ("titulo", "titulo", "text"),
+        ("abstract", "abstract", "text"),
+        ("fecha_publicacion", "fecha_publicacion", "text"),
+        ("idioma", "idioma", "text"),
+        ("num_citas", "num_citas", "count"),
+        ("fwci", "fwci", "metric"),
+        ("tematica_id", "tematica_id", "int"),
+    ],
+    "tecnologia": [
+        ("id", "id", "int"),
+        ("nombre", "nombre", "text"),
+        ("tipo", "tipo", "text"),
+        ("version", "version", "text"),
+    ],
+    "obra_tecnologia": [
+        ("id", "id", "int"),
+        ("obra_id", "obra_id", "int"),
+        ("tecnologia_id", "tecnologia_id", "int"),
+    ],
+}
+
+def clean_text(value):
+    if isinstance(value, str):
+        return value.strip()
+    return None if pd.isna(value) else str(value)
+
+def prepare_frame(table, df):
+    """Cache dataframe -> dataframe with the db column names and types."""
+    if "id" not in df.columns:
+        # tematica_contenida.csv is written without ids by alex_extractor;
+        # read_csv chunks keep a running index, so ids stay unique across chunks
+        df = df.assign(id=df.index + 1)
+    out = pd.DataFrame(index=df.index)
+    for src, dst, kind in TABLE_COLUMNS[table]:
+        col = df[src] if src in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if kind == "text":
+            out[dst] = col.map(clean_text)
+        elif kind == "int":
+            out[dst] = pd.to_numeric(col, errors="coerce").astype("Int64")
+        elif kind == "count":
+            out[dst] = pd.to_numeric(col, errors="coerce").fillna(0).astype("Int64")
+        else:
+            out[dst] = pd.to_numeric(col, errors="coerce").fillna(0.0)
+    return out
+
+def row_hashes(df):
+    """Content hash per prepared row (signed so it fits a BIGINT)."""
+    return pd.util.hash_pandas_object(df, index=False).astype("int64")
+
+def load_row_hashes(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT row_id, row_hash FROM load_state WHERE table_name = %s", (table,))
+        return dict(cursor.fetchall())
+
+def save_row_hashes(cursor, table, ids, hashes):
+    execute_values(cursor, """
+        INSERT INTO load_state (table_name, row_id, row_hash) VALUES %s
+        ON CONFLICT (table_name, row_id) DO UPDATE SET row_hash = EXCLUDED.row_hash, updated_at = now()
+    """, [(table, i, h) for i, h in zip(ids, hashes)])
+
+def bulk_load(cursor, table, df, update=False):
+    """
+    COPY a prepared chunk into the table's temp staging table, then merge it set-based;
+    with update=True existing ids are overwritten instead of skipped. Tables in
+    NATURAL_KEYS keep one row per key and never overwrite an existing one.
+    Returns the number of rows staged and the ids written.
+    """
+    columns = ", ".join(df.columns)
+    staging = f"stg_{table}"
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)")
+    cursor.execute(f"TRUNCATE {staging}")
+    cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    staged = cursor.rowcount
+    select = f"SELECT {columns} FROM {staging}"
+    key = NATURAL_KEYS.get(table)
+    if key:
+        key = ", ".join(key)
+        select = f"SELECT DISTINCT ON ({key}) {columns} FROM {staging} ORDER BY {key}, id"
+        conflict = "ON CONFLICT DO NOTHING"
+    elif update:
+        # one row per id (the last one staged), and none that would take a unique
+        # value held by another row, in the table or earlier in this chunk
+        taken = "".join(f"""
+            AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{c} = s.{c} AND t.id <> s.id)
+            AND NOT EXISTS (SELECT 1 FROM {staging} o WHERE o.{c} = s.{c} AND o.id < s.id)"""
+            for c in UNIQUE_COLUMNS.get(table, []))
+        select = f"SELECT DISTINCT ON (id) {columns} FROM {staging} s WHERE TRUE {taken} ORDER BY id, ctid DESC"
+        assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in df.columns if c != "id")
+        conflict = f"ON CONFLICT (id) DO UPDATE SET {assignments}"
+    else:
+        conflict = "ON CONFLICT DO NOTHING"
+    cursor.execute(f"""
+        INSERT INTO {table} ({columns})
+        {select}
+        {conflict}
+        RETURNING id
+    """)
+    return staged, [row[0] for row in cursor.fetchall()]
+
+def load_table(connection, table, chunksize=CHUNK_SIZE, sync=False):
+    """
+    Stream one cache table into PostgreSQL chunk by chunk, committing after each.
+    With sync=True only rows whose content hash differs from load_state are sent,
+    and they are upserted; rows skipped for a unique conflict are reported and
+    left out of load_state, so the next sync tries them again.
+    """
+    known = load_row_hashes(connection, table) if sync else {}
+    cursor = connection.cursor()
+    start = time.perf_counter()
+    staged = written = unchanged = skipped = 0
+    for chunk in cache_store.read_dataframe_chunks(table, chunksize):
+        df = prepare_frame(table, chunk)
+        if sync:
+            df = df.drop_duplicates("id", keep="last")
+            hashes = row_hashes(df)
+            changed = [known.get(i) != h for i, h in zip(df["id"].tolist(), hashes.tolist())]
+            unchanged += len(df) - sum(changed)
+            df, hashes = df[changed], hashes[changed]
+            if df.empty:
+                continue
+        chunk_staged, written_ids = bulk_load(cursor, table, df, update=sync)
+        if sync:
+            keep = df["id"].isin(written_ids) | (table in NATURAL_KEYS)
+            skipped += int((~keep).sum())
+            save_row_hashes(cursor, table, df["id"][keep].tolist(), hashes[keep].tolist())
+        connection.commit()
+        staged += chunk_staged
+        written += len(written_ids)
+    cursor.execute(f"DROP TABLE IF EXISTS stg_{table}")
+    connection.commit()
+    cursor.close()
+    summary = f"{staged} rows sent ({unchanged} unchanged), {written} upserted" if sync \
+        else f"{staged} rows staged, {written} inserted"
+    print(f"✅ {table}: {summary} in {time.perf_counter() - start:.2f}s")
+    if skipped:
+        print(f"⚠️ {table}: {skipped} rows skipped, their {'/'.join(UNIQUE_COLUMNS.get(table, []))} already belongs to another row")
+
+def table_dependencies(schema_sql=create_db.sql_script):
+    """table -> tables it references, parsed from the CREATE TABLE statements."""
+    deps = {}
+    for table, body in SCHEMA_TABLE_RE.findall(schema_sql):
+        deps[table] = set(re.findall(r"REFERENCES (\w+)", body)) - {table}
+    return deps
+
+def load_with_pool(pool, table, sync=False):
+    connection = pool.getconn()
+    try:
+        load_table(connection, table, sync=sync)
+    finally:
+        pool.putconn(connection)
+
+def load_tables(pool, deps, workers=LOAD_WORKERS, sync=False):
+    """Load every table as soon as the tables it references are loaded."""
+    pending = list(TABLE_COLUMNS)
+    done, running = set(), {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for table in [t for t in pending if deps.get(t, set()) & set(TABLE_COLUMNS) <= done]:
+                pending.remove(table)
+                running[executor.submit(load_with_pool, pool, table, sync)] = table
+            if not running:
+                raise RuntimeError(f"Circular table dependencies: {pending}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table = running.pop(future)
+                future.result()
+                done.add(table)
+
+def drop_constraints(connection, tables):
+    """Drop foreign keys and secondary indexes, returning what is needed to recreate them."""
     cursor = connection.cursor()
+    cursor.execute("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f' AND conrelid::regclass::text = ANY(%s)
+    """, (tables,))
+    foreign_keys = cursor.fetchall()
+    cursor.execute("""
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = ANY(%s)
+          AND indexname NOT IN (SELECT conname FROM pg_constraint)
+    """, (tables,))
+    indexes = cursor.fetchall()
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    dir_cache = os.path.join(script_dir, '../cache')
-
-    # File paths
-    file_tematica = os.path.join(dir_cache, 'tematica.csv')
-    file_tematica_contenida = os.path.join(dir_cache, 'tematica_contenida.csv')
-    file_obra = os.path.join(dir_cache, 'obra.csv')
-    file_tecnologia = os.path.join(dir_cache, 'tecnologia.csv')
-    file_obra_tecnologia = os.path.join(dir_cache, 'obra_tecnologia.csv')
-
-    # Read CSVs
-    df_tematica = pd.read_csv(file_tematica)
-    df_tematica_contenida = pd.read_csv(file_tematica_contenida)
-    df_obra = pd.read_csv(file_obra)
-    df_tecnologia = pd.read_csv(file_tecnologia)
-    df_obra_tecnologia = pd.read_csv(file_obra_tecnologia)
-
-    # Insert tematica
-    for _, row in df_tematica.iterrows():
-        cursor.execute("""
-            INSERT INTO tematica (id, nombre_campo)
-            VALUES (%s, %s)
-            ON CONFLICT (id) DO NOTHING
-        """, (int(row['id']), row['nombre_campo'].strip() if pd.notna(row['nombre_campo']) else None))
-
-    # Insert tematica_contenida
-    for _, row in df_tematica_contenida.iterrows():
-        cursor.execute("""
-            INSERT INTO tematica_contenida (id, tematica_padre_id, tematica_hijo_id)
-            VALUES (%s, %s, %s)
-            ON CONFLICT DO NOTHING
-        """, (int(row['id']), int(row['id_padre']), int(row['id_hijo'])))
-
-    # Insert obra
-    for _, row in df_obra.iterrows():
-        cursor.execute("""
-            INSERT INTO obra (
-                id, doi, direccion_fuente, titulo, abstract, fecha_publicacion,
-                idioma, num_citas, fwci, tematica_id
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO NOTHING
-        """, (
-            int(row['id']),
-            row.get('doi').strip() if pd.notna(row.get('doi')) else None,
-            row['direccion_fuente'].strip() if pd.notna(row.get('direccion_fuente')) else None,
-            row['titulo'].strip() if pd.notna(row.get('titulo')) else None,
-            row.get('abstract').strip() if pd.notna(row.get('abstract')) else None,
-            row.get('fecha_publicacion') if pd.notna(row.get('fecha_publicacion')) else None,
-            row.get('idioma').strip() if pd.notna(row.get('idioma')) else None,
-            int(row.get('num_citas', 0)) if pd.notna(row.get('num_citas')) else 0,
-            float(row.get('fwci', 0.0)) if pd.notna(row.get('fwci')) else 0.0,
-            int(row.get('tematica_id')) if pd.notna(row.get('tematica_id')) else None
-        ))
-
-    # Insert tecnologia
-    for _, row in df_tecnologia.iterrows():
-        cursor.execute("""
-            INSERT INTO tecnologia (id, nombre, tipo, version)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (id) DO NOTHING
-        """, (
-            int(row['id']),
-            row['nombre'].strip() if pd.notna(row['nombre']) else None,
-            row.get('tipo').strip() if pd.notna(row.get('tipo')) else None,
-            row.get('version').strip() if pd.notna(row.get('version')) else None
-        ))
-
-    # Insert obra_tecnologia
-    for _, row in df_obra_tecnologia.iterrows():
-        cursor.execute("""
-            INSERT INTO obra_tecnologia (id, obra_id, tecnologia_id)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (id) DO NOTHING
-        """, (int(row['id']), int(row['obra_id']), int(row['tecnologia_id'])))
-# Puede que on conflict falle por lo de id 
+    for table, name, _ in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
     connection.commit()
     cursor.close()
-    connection.close()
-    print("✅ CSV data loaded successfully including tecnologia and obra_tecnologia.")
+    print(f"Deferred {len(foreign_keys)} foreign keys and {len(indexes)} indexes.")
+    return foreign_keys, indexes
+
+def restore_constraints(connection, foreign_keys, indexes):
+    start = time.perf_counter()
+    cursor = connection.cursor()
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for table, name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    connection.commit()
+    cursor.close()
+    print(f"✅ Restored foreign keys and indexes in {time.perf_counter() - start:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the cache tables into PostgreSQL.")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS, help="tables loaded concurrently")
+    parser.add_argument("--defer-constraints", action="store_true",
+                        help="drop foreign keys and secondary indexes during the load and rebuild them after")
+    parser.add_argument("--sync", action="store_true",
+                        help="send only new or changed rows (tracked in load_state) and upsert them")
+    args = parser.parse_args()
+
+    cache_store.recover_tables()
+    start = time.perf_counter()
+    pool = ThreadedConnectionPool(1, args.workers + 1, **DB_PARAMS)
+    connection = pool.getconn()
+    try:
+        if args.defer_constraints:
+            # without foreign keys every table is independent and can load at once
+            deferred = drop_constraints(connection, list(TABLE_COLUMNS))
+            try:
+                load_tables(pool, {}, args.workers, args.sync)
+            except Exception:
+                # put the constraints back, but never let that hide why the load failed
+                try:
+                    restore_constraints(connection, *deferred)
+                except Exception as e:
+                    connection.rollback()
+                    print(f"⚠️ Could not restore foreign keys and indexes after the failed load: {e}")
+                raise
+            restore_constraints(connection, *deferred)
+        else:
+            load_tables(pool, table_dependencies(), args.workers, args.sync)
+    finally:
+        pool.putconn(connection)
+        pool.closeall()
+    print(f"✅ CSV data loaded successfully including tecnologia and obra_tecnologia in {time.perf_counter() - start:.2f}s.")
 
 if __name__ == "__main__":
     main()
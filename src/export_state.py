@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPORT_STATE_FILE = os.path.join(BASE_DIR, "cache", "rdf_export.sqlite")
+
+def triples_hash(triples):
+    return hashlib.sha256("\n".join(sorted(triples)).encode("utf-8")).hexdigest()
+
+def triple_key(triple):
+    return hashlib.sha1(triple.encode("utf-8")).hexdigest()
+
+class ExportState:
+    """
+    What the graph store currently holds, per exported row: the serialized
+    triples (needed to DELETE them later) and their hash, plus the time of
+    the last completed export. triple_refs counts how many rows assert each
+    triple, so a triple shared by several rows is only deleted with the last.
+    """
+    def __init__(self, path=EXPORT_STATE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS exported (
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                triples_hash TEXT NOT NULL,
+                triples TEXT NOT NULL,
+                PRIMARY KEY (table_name, row_id)
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS triple_refs (triple_key TEXT PRIMARY KEY, refs INTEGER NOT NULL);
+        """)
+        if not self.db.execute("SELECT 1 FROM triple_refs LIMIT 1").fetchone():
+            self.count_refs()
+
+    def count_refs(self):
+        """Rebuild triple_refs from the exported rows (state files written before it existed)."""
+        refs = {}
+        for (triples,) in self.db.execute("SELECT triples FROM exported"):
+            for key in {triple_key(t) for t in json.loads(triples)}:
+                refs[key] = refs.get(key, 0) + 1
+        self.db.executemany("INSERT OR REPLACE INTO triple_refs VALUES (?, ?)", refs.items())
+        self.db.commit()
+
+    def get(self, table, row_id):
+        """(hash, triples) last exported for a row, or None."""
+        row = self.db.execute("SELECT triples_hash, triples FROM exported WHERE table_name = ? AND row_id = ?",
+                              (table, row_id)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def row_ids(self, table):
+        return {r[0] for r in self.db.execute("SELECT row_id FROM exported WHERE table_name = ?", (table,))}
+
+    def refs(self, triples):
+        """{triple: number of exported rows asserting it} for the given serialized triples."""
+        keys = {triple_key(t): t for t in triples}
+        counts = {}
+        batch = list(keys)
+        for i in range(0, len(batch), 500):
+            chunk = batch[i:i + 500]
+            rows = self.db.execute(f"SELECT triple_key, refs FROM triple_refs WHERE triple_key IN ({','.join('?' * len(chunk))})",
+                                   chunk)
+            counts.update((keys[k], n) for k, n in rows)
+        return counts
+
+    def save(self, changes, refs=None):
+        """
+        Record a pushed batch: [(table, row_id, triples or None when deleted)],
+        and the new {triple: count} of the triples it touched.
+        """
+        for triple, count in (refs or {}).items():
+            if count > 0:
+                self.db.execute("INSERT OR REPLACE INTO triple_refs VALUES (?, ?)", (triple_key(triple), count))
+            else:
+                self.db.execute("DELETE FROM triple_refs WHERE triple_key = ?", (triple_key(triple),))
+        for table, row_id, triples in changes:
+            if triples is None:
+                self.db.execute("DELETE FROM exported WHERE table_name = ? AND row_id = ?", (table, row_id))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO exported VALUES (?, ?, ?, ?)",
+                                (table, row_id, triples_hash(triples), json.dumps(triples)))
+        self.db.commit()
+
+    def last_export(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_export'").fetchone()
+        return row[0] if row else None
+
+    def set_last_export(self, timestamp):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_export', ?)", (timestamp,))
+        self.db.commit()
@@ -0,0 +1,128 @@
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+try:
+    from lxml import etree
+except ImportError:  # listed in requirements.txt; html.parser is only a slower fallback
+    etree = None
+
+PARSER = "lxml" if etree is not None else "html.parser"
+ERROR_MARKERS = ["not found", "error 404", "no encontrado", "access denied"]
+ERROR_SCAN_CHARS = 2000  # error pages say so in the title or at the top of the body
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+SKIP_TAGS = {"script", "style", "noscript"}
+
+_stats = {"pages": 0, "seconds": 0.0, "slowest": 0.0}
+_stats_lock = threading.Lock()
+
+class LandingPage:
+    """
+    Collects, in one pass over the parse events, only what the resolver
+    needs: the citation_pdf_url meta tag, the first link to a .pdf, the text
+    of pdf.js textLayer elements, and the title and start of the visible text
+    to recognise error pages.
+    """
+    def __init__(self):
+        self.citation_pdf_url = None
+        self.pdf_link = None
+        self.text_layer = []
+        self.head_text = []
+        self.head_chars = 0
+        self.layer_depth = 0   # > 0 while inside a textLayer element
+        self.skip_depth = 0
+
+    def start(self, tag, attrs):
+        tag = tag.lower()
+        if tag == "meta" and (attrs.get("name") or "").lower() == "citation_pdf_url" and not self.citation_pdf_url:
+            self.citation_pdf_url = attrs.get("content")
+        elif tag == "a" and not self.pdf_link and (attrs.get("href") or "").endswith(".pdf"):
+            self.pdf_link = attrs["href"]
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        if self.layer_depth:
+            self.layer_depth += 1
+        elif "textLayer" in (attrs.get("class") or "") or "textLayer" in (attrs.get("id") or ""):
+            self.layer_depth = 1
+
+    def end(self, tag):
+        tag = tag.lower()
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        if self.layer_depth:
+            self.layer_depth -= 1
+
+    def data(self, text):
+        if self.skip_depth:
+            return
+        if self.layer_depth:
+            self.text_layer.append(text)
+        if self.head_chars < ERROR_SCAN_CHARS:
+            self.head_text.append(text)
+            self.head_chars += len(text)
+
+    def close(self):
+        return self
+
+class StdlibParser(HTMLParser):
+    """html.parser front end feeding LandingPage the same events as lxml's target interface."""
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, {k: v or "" for k, v in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag, {k: v or "" for k, v in attrs})
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+def scan(html):
+    page = LandingPage()
+    parser = etree.HTMLParser(target=page, recover=True) if etree is not None else StdlibParser(page)
+    parser.feed(html)
+    parser.close()
+    return page
+
+def resolve(html, base_url):
+    """
+    What a landing page offers: {"error_page", "text", "pdf_url", "seconds"}.
+    text is the textLayer content of an HTML-rendered PDF; pdf_url prefers
+    the citation_pdf_url meta tag over the first .pdf link.
+    """
+    start = time.perf_counter()
+    page = scan(html)
+    head = " ".join(" ".join(page.head_text).split()).lower()
+    text = " ".join(" ".join(page.text_layer).split())
+    link = page.citation_pdf_url or page.pdf_link
+    seconds = time.perf_counter() - start
+    with _stats_lock:
+        if etree is None and not _stats["pages"]:
+            print("⚠️ lxml is not installed, parsing landing pages with the slower html.parser (pip install lxml)")
+        _stats["pages"] += 1
+        _stats["seconds"] += seconds
+        _stats["slowest"] = max(_stats["slowest"], seconds)
+    return {
+        "error_page": any(marker in head for marker in ERROR_MARKERS),
+        "text": text or None,
+        "pdf_url": urljoin(base_url, link) if link else None,
+        "seconds": seconds,
+    }
+
+def stats():
+    with _stats_lock:
+        pages, seconds, slowest = _stats["pages"], _stats["seconds"], _stats["slowest"]
+    average = seconds / pages * 1000 if pages else 0
+    degraded = "" if etree is not None else " (degraded, lxml missing)"
+    return f"{pages} pages parsed with {PARSER}{degraded}, {average:.1f} ms average, {slowest * 1000:.1f} ms slowest"
@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# host -> (requests per second, max concurrent requests)
+HOST_LIMITS = {
+    "api.openalex.org": (10, 8),
+    "api.unpaywall.org": (5, 4),
+    "dl.acm.org": (1, 2),
+}
+DEFAULT_LIMIT = (5, 4)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+class RateLimiter:
+    """Token bucket shared by every thread that talks to one host."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller of this host, e.g. after a 429."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class HostClient:
+    """Keep-alive session, concurrency cap and rate limit for one host."""
+    def __init__(self, rate, max_concurrent):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.limiter = RateLimiter(rate)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def configure_host(host, rate, max_concurrent):
+    """Override the limits of a host; takes effect for clients created afterwards."""
+    with _clients_lock:
+        HOST_LIMITS[host] = (rate, max_concurrent)
+        _clients.pop(host, None)
+
+def get_client(url):
+    host = urlsplit(url).netloc.lower()
+    with _clients_lock:
+        if host not in _clients:
+            _clients[host] = HostClient(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+        return _clients[host]
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def hold_slot(response, semaphore):
+    """Release the host's concurrency slot only once the streamed response is closed."""
+    close = response.close
+    released = threading.Lock()
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if released.acquire(blocking=False):
+                semaphore.release()
+    response.close = close_and_release
+
+def request(method, url, max_retries=5, **kwargs):
+    """
+    Send a request through the host's pooled session.
+    Retries connection errors and 429/5xx with jittered exponential backoff,
+    honouring Retry-After. Returns the last response, or raises the last
+    exception if no response was ever received. With stream=True the body is
+    read after this returns, so the host's concurrency slot stays taken until
+    the caller closes the response.
+    """
+    client = get_client(url)
+    for attempt in range(max_retries):
+        client.limiter.acquire()
+        client.semaphore.acquire()
+        try:
+            response = client.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            client.semaphore.release()
+            if attempt == max_retries - 1:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"⚠️ Warning: {e}, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            continue
+        except BaseException:
+            client.semaphore.release()
+            raise
+        if kwargs.get("stream"):
+            hold_slot(response, client.semaphore)
+        else:
+            client.semaphore.release()
+
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries - 1:
+            return response
+        delay = retry_after_seconds(response)
+        if delay is None:
+            delay = backoff_delay(attempt)
+        if response.status_code == 429:
+            client.limiter.pause(delay)
+        print(f"⚠️ Warning: Bad response {response.status_code} from {urlsplit(url).netloc}, retrying in {delay:.1f}s...")
+        response.close()
+        time.sleep(delay)
+
+def is_transport_error(exc):
+    """Connection errors, timeouts and retryable statuses (429/5xx), as opposed to unusable content."""
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, requests.RequestException)
+
+def raise_for_transport(response):
+    """Raise requests.HTTPError for a response whose status is a transport failure (429/5xx)."""
+    if response.status_code in RETRY_STATUSES:
+        response.raise_for_status()
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def head(url, **kwargs):
+    return request("HEAD", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,6 @@
+# OpenAlex keyword ids the harvest filters on (one per tracked programming language)
+KEYWORDS = [
+    "python","c-programming-language","javascript","java","java-programming-language",
+    "sql","dart","swift","cobol","fortran","matlab","prolog","lisp","haskell","rust","perl",
+    "scala","html","html5"
+]
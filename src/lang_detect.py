@@ -0,0 +1,126 @@
+import re
+from collections import Counter
+
+import cache_store
+from keywords import KEYWORDS
+from text_prep import strip_references
+
+TECN_TABLE = "tecnologia"
+
+MIN_MENTIONS = 2  # a name seen fewer times than this is left to the LLM
+CONTEXT_CHARS = 40
+
+# OpenAlex keyword ids -> language name
+KEYWORD_NAMES = {
+    "python": "Python", "c-programming-language": "C", "javascript": "JavaScript", "java": "Java",
+    "java-programming-language": "Java", "sql": "SQL", "dart": "Dart", "swift": "Swift", "cobol": "COBOL",
+    "fortran": "Fortran", "matlab": "MATLAB", "prolog": "Prolog", "lisp": "Lisp", "haskell": "Haskell",
+    "rust": "Rust", "perl": "Perl", "scala": "Scala", "html": "HTML", "html5": "HTML",
+}
+ALIASES = {"Golang": "Go", "golang": "Go"}
+
+# Short names that are still unmistakable in running text
+SHORT_NAMES = {"C++", "C#", "F#", "SQL", "PHP", "Lua", "Ada", "Nim", "VBA", "AWK", "Tcl", "Elm"}
+# Names that are also ordinary words, people or places
+COMMON_WORDS = {
+    "Go", "Scheme", "Processing", "Clean", "Curry", "Basic", "Logo", "Shell", "Batch", "Self", "Grace",
+    "Alice", "Just", "Mini", "Mind", "Beta", "Planner", "Reduce", "Maple", "Mercury", "Oak", "April",
+    "Jason", "Tom", "Seq", "Tribe", "Emerald", "Squirrel", "Assembly", "Assembler", "Occam", "Pascal",
+    "Julia", "Scratch", "Nice", "Genus", "Polka", "Epic", "Facile", "Opal", "Blitz", "Troll", "Cobra",
+    "Chariot", "Camelot", "Claire", "Ginger", "Fennel", "Iota", "Anemone", "Karel", "Mojo", "Racket",
+    "Elixir", "Boo", "Fay", "Leda", "Gofer", "Granule", "Whiley", "Simula", "Forth", "Mathematica",
+}
+
+# Evidence that an ambiguous name is meant as a language
+CONTEXT_AFTER = re.compile(
+    r"^\s*(?:programming\s+)?(?:language|code|codes|program|programs|programming|script|scripts|"
+    r"compiler|compilers|implementation|source|package|packages|library|libraries|interpreter|"
+    r"function|functions|module|modules|runtime)\b",
+    re.I,
+)
+CONTEXT_BEFORE = re.compile(
+    r"\b(?:written|implemented|coded|programmed|developed|rewritten|ported|programming)\s+(?:\w+\s+)?in\s+$"
+    r"|\b(?:ANSI|ISO|plain|embedded)\s+$",
+    re.I,
+)
+LIST_GAP = re.compile(r"^\s*(?:,|/|;|\(|\)|and|or|,\s*and|,\s*or)\s*$", re.I)
+# Ambiguous names that are real, common languages: repeated unconfirmed mentions go to the LLM
+NAME_HINTS = {
+    "C": re.compile(r"\bC(?:89|99|11|17)\b|\bANSI C\b|\bgcc\b|\bclang\b"),
+    "R": re.compile(r"\bCRAN\b|\bRStudio\b|\bR package\b|\bR script"),
+    "Go": re.compile(r"\bGolang\b|\bgoroutines?\b", re.I),
+}
+
+def curated_languages():
+    """The KEYWORDS languages: the only names detect() accepts without the LLM."""
+    return {KEYWORD_NAMES[k] for k in KEYWORDS if k in KEYWORD_NAMES}
+
+def language_names(tecn_table=TECN_TABLE):
+    """Vocabulary: the KEYWORDS languages plus every name already in the tecnologia table."""
+    names = curated_languages()
+    if cache_store.table_exists(tecn_table):
+        names.update(row["nombre"].strip() for row in cache_store.read_rows(tecn_table, columns=["nombre"])
+                     if row.get("nombre"))
+    return {n for n in names if re.search(r"[A-Za-z]", n)}
+
+def is_ambiguous(name):
+    return name in COMMON_WORDS or (len(name) <= 3 and name not in SHORT_NAMES)
+
+class LanguageDetector:
+    """
+    Keyword pre-classifier: one compiled alternation of every known name
+    (longest first, case-sensitive, so "C" never matches inside "C++" or
+    "Objective-C"), run on the text before its References section.
+    Ordinary words and very short names only count when their context says
+    they are languages. detect() reports whether the answer is safe to use
+    without asking the LLM; only names in `languages` (the curated KEYWORDS
+    languages) can make it so, since tecnologia.csv also holds tools.
+    """
+    def __init__(self, names=None, languages=None):
+        names = set(names or language_names()) | set(ALIASES)
+        self.languages = set(languages) if languages is not None else curated_languages()
+        alternation = "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+        self.pattern = re.compile(rf"(?<![\w+#\-.])(?:{alternation})(?![\w+#])")
+
+    def confirmed(self, text, match, previous, following, hinted):
+        start, end = match.span()
+        if CONTEXT_AFTER.match(text[end:end + CONTEXT_CHARS]) or CONTEXT_BEFORE.search(text[max(0, start - CONTEXT_CHARS):start]):
+            return True
+        # listed next to an unambiguous language: "C, C++ and Java", "C/C++"
+        for other, gap in ((previous, lambda m: text[m.end():start]), (following, lambda m: text[end:m.start()])):
+            if other is not None and not is_ambiguous(other.group()) and LIST_GAP.match(gap(other)):
+                return True
+        return match.group() in hinted
+
+    def detect(self, text):
+        """
+        {"programming_languages": [...], "uncertain": [...], "confident": bool}.
+        A name is accepted when seen MIN_MENTIONS times or confirmed by its
+        context. It is uncertain when seen only once, or (C, R, Go) when it
+        keeps appearing without any context confirming it. Names outside the
+        curated languages (tools such as PRISM or SPSS) are always uncertain.
+        Documents with uncertain names, or with no known name at all (they may
+        mention a language not in the vocabulary yet), are not confident and
+        should go to the LLM.
+        """
+        body = strip_references(text)
+        matches = list(self.pattern.finditer(body))
+        hinted = {n for n, hint in NAME_HINTS.items() if hint.search(body)}
+        mentions, unconfirmed, confirmed = Counter(), Counter(), set()
+        for i, match in enumerate(matches):
+            name = ALIASES.get(match.group(), match.group())
+            if not is_ambiguous(match.group()):
+                mentions[name] += 1
+                continue
+            previous = matches[i - 1] if i else None
+            following = matches[i + 1] if i + 1 < len(matches) else None
+            if self.confirmed(body, match, previous, following, hinted):
+                mentions[name] += 1
+                confirmed.add(name)
+            else:
+                unconfirmed[name] += 1
+
+        accepted = {n for n, c in mentions.items() if (c >= MIN_MENTIONS or n in confirmed) and n in self.languages}
+        uncertain = {n for n in mentions if n not in accepted}
+        uncertain |= {n for n, c in unconfirmed.items() if n in NAME_HINTS and n not in accepted and c >= MIN_MENTIONS}
+        return {"programming_languages": sorted(accepted), "uncertain": sorted(uncertain), "confident": bool(accepted) and not uncertain}
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import threading
+
+import httpx
+import openai
+
+from http_client import backoff_delay
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = "30m"   # keep the model loaded between requests
+MAX_IN_FLIGHT = 8
+MAX_RETRIES = 3
+REQUEST_TIMEOUT = 300
+BATCH_POLL_SECONDS = 30
+BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+def parse_languages(raw):
+    """
+    The {"programming_languages": [...]} object in a model answer; empty if there
+    is none. Invalid JSON, or a value that is not a list of strings, comes back
+    empty with an "error" key.
+    """
+    json_start = raw.find("{")
+    json_end = raw.rfind("}") + 1
+    if json_start == -1 or json_end == 0:
+        return {"programming_languages": []}
+    try:
+        languages = json.loads(raw[json_start:json_end]).get("programming_languages", [])
+    except json.JSONDecodeError as e:
+        return {"programming_languages": [], "error": f"invalid JSON in answer: {e}"}
+    if not isinstance(languages, list) or not all(isinstance(lang, str) for lang in languages):
+        return {"programming_languages": [], "error": f"programming_languages is not a list of names: {languages!r}"[:200]}
+    return {"programming_languages": sorted(set(languages))}
+
+def response_text(body):
+    """output_text of a Responses API body returned by the Batch API (plain JSON, no SDK object)."""
+    return "".join(part.get("text", "") for item in body.get("output", []) if item.get("type") == "message"
+                   for part in item.get("content", []) if part.get("type") == "output_text")
+
+class AnalysisEngine:
+    """
+    Runs LLM analyses on an asyncio loop in a background thread, so the
+    pipeline threads can submit work and wait on it.
+
+    One client is kept for the whole run: AsyncOpenAI for "gpt", and an
+    httpx keep-alive client on the Ollama HTTP API for "ollama" (with
+    keep_alive so the model stays loaded). At most max_in_flight requests
+    are outstanding. Each item is retried with backoff on its own, and an
+    item that still fails comes back with an "error" key instead of
+    failing the rest of its batch.
+    """
+    def __init__(self, backend, model, render, max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES):
+        self.backend = backend
+        self.model = model
+        self.render = render  # text -> prompt
+        self.max_retries = max_retries
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.call(self.setup(max_in_flight))
+
+    async def setup(self, max_in_flight):
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+        if self.backend == "ollama":
+            self.client = httpx.AsyncClient(base_url=OLLAMA_URL, timeout=REQUEST_TIMEOUT, limits=limits)
+        else:
+            # reads OPENAI_API_KEY / OPENAI_BASE_URL; retries are done per item below
+            self.client = openai.AsyncOpenAI(max_retries=0, timeout=REQUEST_TIMEOUT,
+                                             http_client=httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT))
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def request(self, text):
+        prompt = self.render(text)
+        if self.backend == "ollama":
+            response = await self.client.post("/api/generate", json={
+                "model": self.model, "prompt": prompt, "stream": False,
+                "format": "json", "keep_alive": OLLAMA_KEEP_ALIVE,
+            })
+            response.raise_for_status()
+            body = response.json()
+            if not isinstance(body, dict):
+                raise ValueError(f"unexpected Ollama body: {body!r}"[:200])
+            return body.get("response", "")
+        response = await self.client.responses.create(model=self.model, input=prompt)
+        return response.output_text
+
+    async def analyze_one(self, text):
+        for attempt in range(self.max_retries):
+            try:
+                async with self.semaphore:
+                    raw = await self.request(text)
+                result = parse_languages(raw)
+                if "error" not in result:
+                    return result
+                error = result["error"]
+            except (httpx.HTTPError, openai.APIError, ValueError, KeyError) as e:
+                # ValueError covers a non-JSON body (json.JSONDecodeError)
+                error = e
+            if attempt == self.max_retries - 1:
+                print(f"⚠️ {self.backend} analysis failed: {error}")
+                return {"programming_languages": [], "error": str(error)}
+            delay = backoff_delay(attempt)
+            print(f"⚠️ Warning: {self.backend} request failed ({error}), retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+    def submit(self, text):
+        """concurrent.futures.Future of the analysis of `text`."""
+        return asyncio.run_coroutine_threadsafe(self.analyze_one(text), self.loop)
+
+    def analyze(self, text):
+        return self.submit(text).result()
+
+    def analyze_many(self, texts, poll_seconds=BATCH_POLL_SECONDS):
+        """
+        {key: result} for {key: text}. With "gpt" this goes through the Batch
+        API (one upload, half price, results within the 24h window) and only
+        items missing from its output are retried online (all of them if the
+        batch itself fails); Ollama has no batch endpoint, so its items are
+        simply run concurrently.
+        """
+        if self.backend != "gpt":
+            return self.call(self.gather(texts))
+        try:
+            results = self.call(self.batch(texts, poll_seconds))
+        except Exception as e:
+            print(f"⚠️ Warning: batch failed ({e}), analyzing its documents online...")
+            results = {}
+        retry = {key: text for key, text in texts.items() if key not in results}
+        if retry:
+            print(f"⚠️ {len(retry)} batch items failed, retrying them online...")
+            results.update(self.call(self.gather(retry)))
+        return results
+
+    async def gather(self, texts):
+        keys = list(texts)
+        results = await asyncio.gather(*(self.analyze_one(texts[k]) for k in keys), return_exceptions=True)
+        return {key: {"programming_languages": [], "error": str(result)} if isinstance(result, Exception) else result
+                for key, result in zip(keys, results)}
+
+    async def batch(self, texts, poll_seconds):
+        lines = [json.dumps({
+            "custom_id": str(key), "method": "POST", "url": "/v1/responses",
+            "body": {"model": self.model, "input": self.render(text)},
+        }) for key, text in texts.items()]
+        batch_file = await self.client.files.create(file=("analysis_batch.jsonl", "\n".join(lines).encode("utf-8")),
+                                                    purpose="batch")
+        batch = await self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/responses",
+                                                 completion_window="24h")
+        print(f"📦 Submitted batch {batch.id} with {len(lines)} documents")
+        while batch.status not in BATCH_DONE:
+            await asyncio.sleep(poll_seconds)
+            batch = await self.client.batches.retrieve(batch.id)
+            print(f"📦 Batch {batch.id}: {batch.status}")
+        if not batch.output_file_id:
+            return {}
+
+        keys = {str(key): key for key in texts}
+        content = await self.client.files.content(batch.output_file_id)
+        results = {}
+        for line in content.text.splitlines():
+            try:
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    continue
+                result = parse_languages(response_text(response["body"]))
+                if "error" not in result:
+                    results[keys[item["custom_id"]]] = result
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+        return results
+
+    def close(self):
+        self.call(self.client.aclose() if self.backend == "ollama" else self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
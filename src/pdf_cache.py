@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF_CACHE_DIR = os.path.join(BASE_DIR, "cache", "pdf_text")
+PDF_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+class TextCache:
+    """
+    Content-addressed store of extracted PDF text.
+    Each text is gzipped once under its sha256; DOIs and URLs point at that
+    hash, and blobs are evicted least-recently-used once the store grows
+    past max_bytes.
+    """
+    def __init__(self, path=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, hash TEXT NOT NULL, source_url TEXT);
+            CREATE INDEX IF NOT EXISTS idx_blobs_access ON blobs(last_access);
+        """)
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, "blobs", digest[:2], f"{digest}.txt.gz")
+
+    def get(self, keys):
+        """Return (text, source_url) for the first cached key, or None."""
+        with self.lock:
+            for key in filter(None, keys):
+                row = self.db.execute("SELECT hash, source_url FROM entries WHERE key = ?", (key,)).fetchone()
+                if not row or not os.path.exists(self.blob_path(row[0])):
+                    continue
+                with gzip.open(self.blob_path(row[0]), "rt", encoding="utf-8") as f:
+                    text = f.read()
+                self.db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), row[0]))
+                self.db.commit()
+                self.hits += 1
+                return text, row[1]
+            self.misses += 1
+            return None
+
+    def put(self, keys, text, source_url):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        path = self.blob_path(digest)
+        with self.lock:
+            known = self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if not known:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(f"{path}.tmp", path)
+                size = os.path.getsize(path)
+                self.db.execute("INSERT INTO blobs (hash, size, last_access) VALUES (?, ?, ?)", (digest, size, time.time()))
+                self.total_bytes += size
+            for key in filter(None, keys):
+                self.db.execute("INSERT OR REPLACE INTO entries (key, hash, source_url) VALUES (?, ?, ?)",
+                                (key, digest, source_url))
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes:
+            row = self.db.execute("SELECT hash, size FROM blobs ORDER BY last_access LIMIT 1").fetchone()
+            if not row:
+                break
+            digest, size = row
+            self.db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            self.db.execute("DELETE FROM entries WHERE hash = ?", (digest,))
+            if os.path.exists(self.blob_path(digest)):
+                os.remove(self.blob_path(digest))
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return (f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), {self.evictions} evictions, "
+                f"{self.total_bytes / 1024 ** 2:.1f} MB cached")
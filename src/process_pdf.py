@@ -1,23 +1,52 @@
-import csv
 import os
+import argparse
 import io
-import requests
-import json
 import openai
 import subprocess
-from bs4 import BeautifulSoup
+import queue
+import threading
+import multiprocessing
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import fitz 
+import http_client
+import cache_store
+from pdf_cache import TextCache
+import source_cache
+import html_resolver
+from source_cache import SourceCache
+from work_ledger import WorkLedger, EXTRACTED, FAILED
+from analysis_cache import AnalysisCache, text_hash, prompt_version
+from lang_detect import LanguageDetector
+import text_prep
+from llm_engine import AnalysisEngine, parse_languages
 
 
 MODEL_NAME = "mistral:instruct"
+GPT_MODEL = "gpt-5-nano"
 PDF_TIMEOUT = 30
+MAX_PDF_BYTES = 50 * 1024 ** 2   # larger downloads are abandoned
+MAX_HTML_BYTES = 5 * 1024 ** 2
+SPOOL_BYTES = 8 * 1024 ** 2      # PDFs above this are spooled to a temp file instead of kept in memory
+STREAM_CHUNK = 64 * 1024
+SNIFF_BYTES = 1024               # "%PDF-" must appear within the first 1024 bytes
+PAGE_BUDGET = 60                 # pages extracted per document
+REFERENCES_MIN_PAGE = 2          # a References heading before this page is a table of contents
+DOWNLOAD_WORKERS = 8
+EXTRACT_WORKERS = os.cpu_count() or 2
+ANALYSIS_WORKERS = 4
+IN_FLIGHT = 8  # LLM requests outstanding at once
+QUEUE_SIZE = 16
 UNPAYWALL_EMAIL = "your_email@example.com"
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CACHE_DIR = os.path.join(BASE_DIR, "cache")
-OBRAS_CSV = os.path.join(CACHE_DIR, "obra.csv")
-TECN_CSV = os.path.join(CACHE_DIR, "tecnologia.csv")
-OBRA_TECN_CSV = os.path.join(CACHE_DIR, "obra_tecnologia.csv")
+TECN_TABLE = "tecnologia"
+OBRA_TECN_TABLE = "obra_tecnologia"
+TECN_FIELDS = ["id", "nombre"]
+LINK_FIELDS = ["id", "obra_id", "tecnologia_id"]
+FLUSH_EVERY = 20  # obras buffered before tecnologia/obra_tecnologia rows hit disk
 
 
 instructions = """You are a text analysis assistant specialized in identifying programming languages mentioned in academic or technical articles.
@@ -33,202 +62,337 @@ If none found:
 }
 """
 
+GPT_PROMPT = """
+            You are a text analysis assistant specialized in identifying programming languages mentioned in academic or technical articles.
+
+            Task:
+            1️⃣ Identify **only actual programming languages** used to write code.
+            2️⃣ Do **NOT** include frameworks, libraries, standards, formal languages, or platforms.
+            3️⃣ Ignore any text after a “References” or “Bibliography” section.
+            4️⃣ Return strictly in JSON:
+
+            {{"programming_languages": ["Python", "C", "Java"]}}
+
+            If none found, return:
+
+            {{"programming_languages": []}}
+
+
+            Text:
+            {pdf_text}
+"""
+
 os.makedirs(CACHE_DIR, exist_ok=True)
 
 # ----------------------
-# CSV helpers
+# Cache helpers
 # ----------------------
-def read_obras_from_csv(file_path):
+def read_obras():
     obras = []
-    with open(file_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            obras.append((int(row["id"]), row["direccion_fuente"], row.get("doi")))
+    for row in cache_store.read_rows("obra", columns=["id", "direccion_fuente", "doi"]):
+        obras.append((int(row["id"]), row["direccion_fuente"], row.get("doi")))
     return obras
 
-def init_csv(file_path, headers=None):
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-        with open(file_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            if headers:
-                writer.writerow(headers)
-        return 1
-    max_id = 0
-    with open(file_path, "r", newline="", encoding="utf-8") as f:
-        try:
-            reader = csv.DictReader(f)
-            for row in reader:
-                val = row.get("id")
-                if val:
-                    try:
-                        max_id = max(max_id, int(val))
-                    except:
-                        continue
-        except:
-            f.seek(0)
-            for line in f:
-                parts = line.split(",")
-                if parts:
-                    try:
-                        max_id = max(max_id, int(parts[0].strip()))
-                    except:
-                        continue
-    return max_id + 1
-
-def append_unique_to_csv(file_path, row, headers=None, key_index=1):
-    init_csv(file_path, headers=headers)
-    existing_keys = set()
-    with open(file_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        peek = next(reader, None)
-        if headers and peek and all(h in peek for h in headers):
-            pass
-        else:
-            if peek:
-                try:
-                    existing_keys.add(peek[key_index])
-                except:
-                    pass
-        for r in reader:
-            try:
-                existing_keys.add(r[key_index])
-            except:
+def load_links(table=OBRA_TECN_TABLE):
+    return {(int(row["obra_id"]), int(row["tecnologia_id"]))
+            for row in cache_store.read_rows(table, columns=["obra_id", "tecnologia_id"])}
+
+def load_tecnologias(table=TECN_TABLE):
+    return {row["nombre"]: int(row["id"]) for row in cache_store.read_rows(table, columns=["id", "nombre"])}
+
+class TechRegistry:
+    """
+    In-memory tecnologia map and id allocator for tecnologia/obra_tecnologia.
+    Both tables are read once; new rows are buffered and written every
+    `flush_every` obras, tecnologia first and fsynced, so a link row on disk
+    never points at a technology that is not. on_flush(obra_ids) is called
+    once the obras' rows are durable. Links are unique per (obra, tecnologia),
+    so reprocessing an obra adds nothing.
+    """
+    def __init__(self, tecn_table=TECN_TABLE, link_table=OBRA_TECN_TABLE, flush_every=FLUSH_EVERY, on_flush=None):
+        self.tables = ((tecn_table, TECN_FIELDS), (link_table, LINK_FIELDS))
+        self.flush_every = flush_every
+        for table, fields in self.tables:
+            if cache_store.table_exists(table):
+                cache_store.repair_tail(table)
+            else:
+                cache_store.init_table(table, fields)
+        self.next_tecn_id = cache_store.next_id(tecn_table)
+        self.next_link_id = cache_store.next_id(link_table)
+        self.tech_map = load_tecnologias(tecn_table)  # { "Python": 89, "C": 90, ... }
+        self.links = load_links(link_table)           # { (obra_id, tecnologia_id), ... }
+        self.pending_tecn = []
+        self.pending_links = []
+        self.pending_obras = []
+        self.on_flush = on_flush
+
+    def add(self, obra_id, languages):
+        for lang in languages:
+            if lang not in self.tech_map:
+                self.tech_map[lang] = self.next_tecn_id
+                self.pending_tecn.append([self.next_tecn_id, lang])
+                self.next_tecn_id += 1
+            link = (obra_id, self.tech_map[lang])
+            if link in self.links:
                 continue
-    key = row[key_index] if len(row) > key_index else None
-    if key not in existing_keys:
-        with open(file_path, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(row)
-
-
-
-def append_to_csv(file_path, row, headers=None):
-    """Simple append without uniqueness (for obra_tecnologia)"""
-    file_exists = os.path.exists(file_path)
-    with open(file_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if not file_exists and headers:
-            writer.writerow(headers)
-        writer.writerow(row)
-def load_tecnologias(file_path):
-    tech_map = {}
-    if os.path.exists(file_path):
-        with open(file_path, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                tech_map[row["nombre"]] = int(row["id"])
-    return tech_map
+            self.links.add(link)
+            self.pending_links.append([self.next_link_id, *link])
+            self.next_link_id += 1
+        self.pending_obras.append(obra_id)
+        if len(self.pending_obras) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for (table, fields), rows in zip(self.tables, (self.pending_tecn, self.pending_links)):
+            if not rows:
+                continue
+            cache_store.append_rows(table, fields, rows)
+            rows.clear()
+        flushed, self.pending_obras = self.pending_obras, []
+        if self.on_flush and flushed:
+            self.on_flush(flushed)
 
 # ----------------------
 # PDF + Analysis
 # ----------------------
-def get_text_from_pdf_url(pdf_url, doi=None):
+def extract_pdf_text(pdf, page_budget=PAGE_BUDGET):
+    """
+    Parse a PDF (bytes, or the path of a spooled file, which PyMuPDF reads
+    page by page) with PyMuPDF; top-level so it can run in a worker process.
+    Stops after page_budget pages or at the References heading.
+    """
+    if isinstance(pdf, str):
+        doc = fitz.open(pdf)
+    else:
+        doc = fitz.open(stream=io.BytesIO(pdf), filetype="pdf")
+    pages = []
+    with doc:
+        for number, page in enumerate(doc):
+            if number >= page_budget:
+                break
+            page_text = page.get_text()
+            heading = text_prep.REFERENCES_RE.search(page_text) if number >= REFERENCES_MIN_PAGE else None
+            if heading:
+                pages.append(page_text[:heading.start()])
+                break
+            pages.append(page_text)
+    text = "\n\n".join(pages)
+    if not text.strip():
+        raise ValueError("No text extracted from PDF")
+    return text.strip()
+
+def sniff_kind(head, content_type):
+    """"pdf", "html" or None, from the first bytes of the body; the header only breaks ties."""
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return "pdf"
+    start = head.lstrip(b"\xef\xbb\xbf \t\r\n")[:1]
+    if start == b"<" or "text/html" in content_type:
+        return "html"
+    return None
+
+def spool_pdf(chunks):
+    """
+    Read a PDF body: bytes while it stays under SPOOL_BYTES, otherwise the
+    path of a temp file (removed by the caller). Raises past MAX_PDF_BYTES.
+    """
+    buffer, spool, size = io.BytesIO(), None, 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_PDF_BYTES:
+                raise ValueError(f"PDF larger than {MAX_PDF_BYTES // 1024 ** 2} MB")
+            if spool is None and size > SPOOL_BYTES:
+                spool = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+                spool.write(buffer.getvalue())
+                buffer = None
+            (spool or buffer).write(chunk)
+    except BaseException:
+        if spool:
+            spool.close()
+            os.remove(spool.name)
+        raise
+    if spool is None:
+        return buffer.getvalue()
+    spool.close()
+    return spool.name
+
+def fetch_document(url, headers):
+    """
+    Stream a URL and return ("pdf", bytes or temp file path), ("html", text)
+    or (None, None), deciding from the first bytes so oversized or unusable
+    bodies are dropped without being downloaded.
+    """
+    response = http_client.get(url, headers=headers, timeout=PDF_TIMEOUT, max_retries=2, stream=True)
+    try:
+        http_client.raise_for_transport(response)
+        length = int(response.headers.get("Content-Length") or 0)
+        if length > MAX_PDF_BYTES:
+            print(f"⚠️ Skipping {url}: {length // 1024 ** 2} MB body")
+            return None, None
+        chunks = response.iter_content(STREAM_CHUNK)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_BYTES:
+                break
+        kind = sniff_kind(head, response.headers.get("Content-Type", "").lower())
+        if kind == "pdf":
+            return kind, spool_pdf(itertools.chain([head], chunks))
+        if kind == "html":
+            body = bytearray(head)
+            for chunk in chunks:
+                body += chunk
+                if len(body) > MAX_HTML_BYTES:
+                    break
+            return kind, bytes(body[:MAX_HTML_BYTES]).decode(response.encoding or "utf-8", errors="replace")
+        return None, None
+    finally:
+        response.close()
+
+def get_text_from_pdf_url(pdf_url, doi=None, extract=extract_pdf_text, sources=None):
+    """
+    Text of an obra and the URL it came from, or (None, None). Candidates are
+    tried in order: the URL that last worked for this DOI, the given URL,
+    Unpaywall, then ACM, each at most once. With a SourceCache, known-dead
+    URLs and hosts with an open circuit breaker are skipped and every outcome
+    is recorded for the next run; only transport failures count against a host.
+    """
     tried_urls = set()
     headers = {'User-Agent': 'Mozilla/5.0'}
-    
-    def fetch_unpaywall_pdf(doi):
-        if not doi:
-            return None
+
+    def memoized(key, lookup_url, lookup):
+        if sources:
+            found, url = sources.lookup(key)
+            if found:
+                return url
+            if sources.is_dead(lookup_url):
+                return None
         try:
-            unpaywall_url = f"https://api.unpaywall.org/v2/{doi}?email={UNPAYWALL_EMAIL}"
-            r = requests.get(unpaywall_url, timeout=10)
-            if r.status_code == 200:
-                data = r.json()
-                pdf_link = data.get("best_oa_location", {}).get("url_for_pdf")
-                if pdf_link:
-                    print(f"📖 Found Unpaywall PDF: {pdf_link}")
-                    return pdf_link
+            url, ok = lookup()
         except Exception as e:
-            print(f"⚠️ Unpaywall fetch failed: {e}")
-        return None
-
+            print(f"⚠️ {key.split(':')[0]} fetch failed: {e}")
+            if sources and http_client.is_transport_error(e):
+                sources.host_result(lookup_url, ok=False)
+            return None
+        if sources:
+            sources.host_result(lookup_url, ok=True)
+            if ok:
+                sources.store_lookup(key, url)
+        return url
 
-def get_text_from_pdf_url(pdf_url, doi=None):
-    tried_urls = set()
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    
     def fetch_unpaywall_pdf(doi):
         if not doi:
             return None
-        try:
-            unpaywall_url = f"https://api.unpaywall.org/v2/{doi}?email={UNPAYWALL_EMAIL}"
-            r = requests.get(unpaywall_url, timeout=10)
-            if r.status_code == 200:
-                data = r.json()
-                pdf_link = data.get("best_oa_location", {}).get("url_for_pdf")
-                if pdf_link:
-                    print(f"📖 Found Unpaywall PDF: {pdf_link}")
-                    return pdf_link
-        except Exception as e:
-            print(f"⚠️ Unpaywall fetch failed: {e}")
-        return None
+        unpaywall_url = f"https://api.unpaywall.org/v2/{doi}?email={UNPAYWALL_EMAIL}"
+        def lookup():
+            r = http_client.get(unpaywall_url, timeout=10, max_retries=3)
+            http_client.raise_for_transport(r)
+            if r.status_code == 404:
+                return None, True
+            if r.status_code != 200:
+                return None, False
+            pdf_link = (r.json().get("best_oa_location") or {}).get("url_for_pdf")
+            if pdf_link:
+                print(f"📖 Found Unpaywall PDF: {pdf_link}")
+            return pdf_link, True
+        return memoized(f"unpaywall:{doi}", unpaywall_url, lookup)
 
     def fetch_acm_pdf(doi):
         if not doi:
             return None
-        try:
-            acm_url = f"https://dl.acm.org/doi/pdf/{doi}"
-            r = requests.head(acm_url, allow_redirects=True, timeout=10)
+        acm_url = f"https://dl.acm.org/doi/pdf/{doi}"
+        def lookup():
+            r = http_client.head(acm_url, allow_redirects=True, timeout=10, max_retries=2)
+            http_client.raise_for_transport(r)
             if r.status_code == 200 and "pdf" in r.headers.get("Content-Type", "").lower():
                 print(f"📄 Found ACM PDF: {acm_url}")
-                return acm_url
-        except Exception as e:
-            print(f"⚠️ ACM fetch failed: {e}")
+                return acm_url, True
+            return None, r.status_code == 404
+        return memoized(f"acm:{doi}", acm_url, lookup)
+
+    candidates = iter([
+        lambda: sources.resolved_url(doi) if sources else None,
+        lambda: pdf_url,
+        lambda: fetch_unpaywall_pdf(doi),
+        lambda: fetch_acm_pdf(doi),
+    ])
+
+    def next_candidate():
+        for candidate in candidates:
+            url = candidate()
+            if url and url not in tried_urls and not (sources and sources.is_dead(url)):
+                return url
         return None
 
-    while pdf_url and pdf_url not in tried_urls:
+    def failed(url, reason, ttl=None, transport=False):
+        if sources:
+            sources.mark_failed(url, reason, ttl or source_cache.DEAD_URL_TTL, transport)
+        return next_candidate()
+
+    pdf_url = next_candidate()
+    while pdf_url:
         tried_urls.add(pdf_url)
         try:
-            response = requests.get(pdf_url, headers=headers, timeout=PDF_TIMEOUT)
-            content_type = response.headers.get("Content-Type", "").lower()
+            kind, body = fetch_document(pdf_url, headers)
 
-            if "application/pdf" in content_type:
+            if kind == "pdf":
                 try:
-                    pdf_bytes = io.BytesIO(response.content)
-                    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-                    text = "\n\n".join([page.get_text() for page in doc])
-                    if not text.strip():
-                        raise ValueError("No text extracted from PDF")
-                    return text.strip(), pdf_url
+                    text = extract(body)
+                    if sources:
+                        sources.mark_ok(pdf_url, doi)
+                    return text, pdf_url
                 except Exception as e:
                     print(f"⚠️ PDF parse error with PyMuPDF: {e}")
-                pdf_url = fetch_unpaywall_pdf(doi) or fetch_acm_pdf(doi)
+                finally:
+                    if isinstance(body, str):
+                        os.remove(body)
+                pdf_url = failed(pdf_url, "unparseable pdf")
                 continue
 
-            if "text/html" in content_type:
-                soup = BeautifulSoup(response.text, "html.parser")
-                body_text = soup.get_text(separator=' ', strip=True).lower()
-                if any(x in body_text for x in ["not found", "error 404", "no encontrado", "access denied"]):
-                    pdf_url = fetch_unpaywall_pdf(doi) or fetch_acm_pdf(doi)
+            if kind == "html":
+                page = html_resolver.resolve(body, pdf_url)
+                print(f"🧩 Parsed landing page {pdf_url} in {page['seconds'] * 1000:.1f} ms")
+                if page["error_page"]:
+                    pdf_url = failed(pdf_url, "error page")
                     continue
-                text_labels = soup.select('[class*="textLayer"], [id*="textLayer"] div, span')
-                texts = [el.get_text(separator=' ', strip=True) for el in text_labels]
-                if texts:
-                    return " ".join(texts), pdf_url
-                pdf_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.pdf')]
-                if pdf_links:
-                    next_pdf = requests.compat.urljoin(pdf_url, pdf_links[0])
-                    if next_pdf not in tried_urls:
+                if page["text"]:
+                    if sources:
+                        sources.mark_ok(pdf_url, doi)
+                    return page["text"], pdf_url
+                next_pdf = page["pdf_url"]
+                if next_pdf:
+                    if next_pdf not in tried_urls and not (sources and sources.is_dead(next_pdf)):
                         pdf_url = next_pdf
                         continue
-                pdf_url = fetch_unpaywall_pdf(doi) or fetch_acm_pdf(doi)
+                pdf_url = failed(pdf_url, "html without text or pdf link")
                 continue
 
-            pdf_url = fetch_unpaywall_pdf(doi) or fetch_acm_pdf(doi)
+            pdf_url = failed(pdf_url, "not a pdf or html page")
 
         except Exception as e:
             print(f"⚠️ Exception while fetching PDF: {e}")
-            pdf_url = fetch_unpaywall_pdf(doi) or fetch_acm_pdf(doi)
+            pdf_url = failed(pdf_url, f"error: {e}"[:200], source_cache.TRANSIENT_TTL,
+                             transport=http_client.is_transport_error(e))
 
     print("❌ No valid PDF or text found.")
     return None, None
 
+def fetch_text(pdf_url, doi=None, extract=extract_pdf_text, cache=None, sources=None):
+    """get_text_from_pdf_url behind the on-disk text cache (keyed by DOI and URL)."""
+    if cache:
+        cached = cache.get([doi, pdf_url])
+        if cached:
+            return cached
+    text, final_url = get_text_from_pdf_url(pdf_url, doi, extract=extract, sources=sources)
+    if cache and text:
+        cache.put([doi, pdf_url, final_url], text, final_url)
+    return text, final_url
+
 
 
 def estimate_tokens(text: str) -> int:
     """Estimate the number of tokens in a string for GPT models."""
-    return len(ENCODING.encode(text))
+    return text_prep.count_tokens(text)
 
 def analyze_text(instructions, pdf_text):
     detected_languages = set()
@@ -245,28 +409,14 @@ def analyze_text(instructions, pdf_text):
                 encoding="utf-8",
                 errors="ignore"
             )
-            raw = result.stdout.strip()
-            json_start = raw.find("{")
-            json_end = raw.rfind("}") + 1
-            if json_start != -1 and json_end != -1:
-                llm_result = json.loads(raw[json_start:json_end])
-                detected_languages.update(llm_result.get("programming_languages", []))
-        except Exception:
-            pass
+            return parse_languages(result.stdout.strip())
+        except Exception as e:
+            return {"programming_languages": sorted(detected_languages), "error": str(e)}
 
     return {"programming_languages": sorted(detected_languages)}
 
-# Make sure to set your API key in the environment
-# export OPENAI_API_KEY="sk-..."
-def analyze_text_with_gpt(pdf_text, model="gpt-5-nano"):
-    """
-    Analyze PDF text using ChatGPT Responses API.
-    Returns a set of detected programming languages.
-    Automatically skips blocked content.
-    """
-    detected_languages = set()
-
-    # Blocked content check
+def blocked_content(pdf_text):
+    """True for access-denied / error pages that were saved instead of the article."""
     blocked_indicators = [
         "enable javascript and cookies to continue",
         "access denied",
@@ -274,7 +424,27 @@ def analyze_text_with_gpt(pdf_text, model="gpt-5-nano"):
         "error 404"
     ]
     preview_text = pdf_text[:300].replace("\n", " ").lower()
-    if any(b in preview_text for b in blocked_indicators):
+    return any(b in preview_text for b in blocked_indicators)
+
+def render_prompt(backend):
+    """text -> prompt for the backend, as analyze_text / analyze_text_with_gpt build it."""
+    if backend == "ollama":
+        return lambda pdf_text: f"{instructions}\n\nText:\n{pdf_text}"
+    return lambda pdf_text: GPT_PROMPT.format(pdf_text=pdf_text)
+
+def create_engine(backend="gpt", in_flight=IN_FLIGHT):
+    model = MODEL_NAME if backend == "ollama" else GPT_MODEL
+    return AnalysisEngine(backend, model, render_prompt(backend), max_in_flight=in_flight)
+
+# Make sure to set your API key in the environment
+# export OPENAI_API_KEY="sk-..."
+def analyze_text_with_gpt(pdf_text, model=GPT_MODEL):
+    """
+    Analyze PDF text using ChatGPT Responses API.
+    Returns a set of detected programming languages.
+    Automatically skips blocked content.
+    """
+    if blocked_content(pdf_text):
         print("⚠️ Blocked content detected, skipping analysis.")
         return {"programming_languages": []}
 
@@ -282,93 +452,258 @@ def analyze_text_with_gpt(pdf_text, model="gpt-5-nano"):
     try:
         response = openai.responses.create(
             model=model,
-            input=f"""
-            You are a text analysis assistant specialized in identifying programming languages mentioned in academic or technical articles.
-
-            Task:
-            1️⃣ Identify **only actual programming languages** used to write code.
-            2️⃣ Do **NOT** include frameworks, libraries, standards, formal languages, or platforms.
-            3️⃣ Ignore any text after a “References” or “Bibliography” section.
-            4️⃣ Return strictly in JSON:
-
-            {{"programming_languages": ["Python", "C", "Java"]}}
-
-            If none found, return:
-
-            {{"programming_languages": []}}
-
-
-            Text:
-            {pdf_text}
-"""
+            input=GPT_PROMPT.format(pdf_text=pdf_text)
         )
-        raw = response.output_text.strip()
-        json_start = raw.find("{")
-        json_end = raw.rfind("}") + 1
-        if json_start != -1 and json_end != -1:
-            llm_result = json.loads(raw[json_start:json_end])
-            detected_languages.update(llm_result.get("programming_languages", []))
+        result = parse_languages(response.output_text.strip())
     except Exception as e:
         print(f"⚠️ GPT analysis failed: {e}")
+        return {"programming_languages": [], "error": str(e)}
+    if "error" in result:
+        print(f"⚠️ GPT analysis failed: {result['error']}")
+    return result
 
-    return {"programming_languages": sorted(detected_languages)}
+def analyze(pdf_text, backend="gpt", cache=None, detector=None, prefilter=True,
+            token_budget=text_prep.TOKEN_BUDGET, engine=None, defer=False):
+    """
+    Run the chosen backend, memoized on (hash of the full text with the
+    reducer version and token_budget, model, prompt version), so a hit skips
+    the reduction too. Failed calls carry an "error" key and are not cached. With prefilter,
+    documents the detector classifies confidently never reach the LLM and
+    come back with "source": "keywords"; the rest are reduced to the passages
+    around language mentions within token_budget before being sent, through
+    `engine` when given. With defer, nothing is sent: the result carries the
+    reduced text under "deferred" and its cache key, for a later batch.
+    """
+    detector = detector or LanguageDetector()
+    if prefilter:
+        detection = detector.detect(pdf_text)
+        if detection["confident"]:
+            return {"programming_languages": detection["programming_languages"], "source": "keywords"}
+    model, prompt = (MODEL_NAME, instructions) if backend == "ollama" else (GPT_MODEL, GPT_PROMPT)
+    source = text_hash(f"{text_prep.reducer_version()}/{token_budget}\n{pdf_text}")
+    key = (source, model, prompt_version(prompt))
+    if cache is not None:
+        cached = cache.get(*key)
+        if cached is not None:
+            return cached
+
+    if token_budget:
+        pdf_text = text_prep.reduce_text(pdf_text, detector.pattern, token_budget)
+    if backend == "ollama":
+        run = lambda: analyze_text(instructions, pdf_text)
+    else:
+        run = lambda: analyze_text_with_gpt(pdf_text, model=model)
+        if blocked_content(pdf_text):
+            print("⚠️ Blocked content detected, skipping analysis.")
+            return {"programming_languages": []}
+    if engine is not None:
+        run = lambda: engine.analyze(pdf_text)
+
+    if defer:
+        return {"deferred": pdf_text, "cache_key": key}
+    result = run()
+    if cache is not None and "error" not in result:
+        cache.put(*key, result)
+    return result
 
 # ----------------------
-# Main loop
+# Pipeline
 # ----------------------
-def process_all_obras():
-    obras = read_obras_from_csv(OBRAS_CSV)
-    print(f"Found {len(obras)} obras in CSV.")
+_DONE = object()
 
-    next_tecn_id = init_csv(TECN_CSV, headers=["id","nombre"])
-    next_link_id = init_csv(OBRA_TECN_CSV, headers=["id","obra_id","tecnologia_id"])
+def run_pipeline(obras, handle_result, download_workers=DOWNLOAD_WORKERS,
+                 extract_workers=EXTRACT_WORKERS, analysis_workers=ANALYSIS_WORKERS, cache=None,
+                 analysis_cache=None, backend="gpt", detector=None, prefilter=True,
+                 token_budget=text_prep.TOKEN_BUDGET, engine=None, defer=False, sources=None, ledger=None):
+    """
+    Download -> extract -> analyze, connected by bounded queues.
+    Downloads run in I/O threads that hand PDF parsing to a process pool, analysis
+    runs in its own threads, and handle_result(obra_id, text, final_url, result)
+    is called from the calling thread only, so bookkeeping needs no locking.
+    """
+    obra_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    text_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    result_queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    with ProcessPoolExecutor(max_workers=extract_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as cpu_pool:
+        def extract(pdf):
+            return cpu_pool.submit(extract_pdf_text, pdf).result()
+
+        def feed():
+            for obra in obras:
+                obra_queue.put(obra)
+            for _ in range(download_workers):
+                obra_queue.put(_DONE)
+
+        def download():
+            while True:
+                item = obra_queue.get()
+                if item is _DONE:
+                    return
+                obra_id, pdf_url, doi = item
+                try:
+                    text, final_url = fetch_text(pdf_url, doi, extract=extract, cache=cache, sources=sources)
+                except Exception as e:
+                    print(f"⚠️ Unexpected error fetching Obra ID {obra_id}: {e}")
+                    text, final_url = None, None
+                if ledger:
+                    if text:
+                        ledger.mark(obra_id, EXTRACTED, source_url=final_url)
+                    else:
+                        ledger.mark(obra_id, FAILED, "no pdf or text found")
+                text_queue.put((obra_id, text, final_url))
+
+        def analyze_worker():
+            while True:
+                item = text_queue.get()
+                if item is _DONE:
+                    return
+                obra_id, text, final_url = item
+                result = None
+                if text:
+                    print(f"🤖 Analyzing text for Obra ID {obra_id}...")
+                    try:
+                        result = analyze(text, backend=backend, cache=analysis_cache, detector=detector,
+                                         prefilter=prefilter, token_budget=token_budget, engine=engine, defer=defer)
+                    except Exception as e:
+                        print(f"⚠️ Analysis failed for Obra ID {obra_id}: {e}")
+                        result = {"programming_languages": [], "error": str(e)}
+                result_queue.put((obra_id, text, final_url, result))
+
+        def stage(target, count, downstream, sentinels):
+            threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for _ in range(sentinels):
+                downstream.put(_DONE)
+
+        threading.Thread(target=feed, daemon=True).start()
+        threading.Thread(target=stage, args=(download, download_workers, text_queue, analysis_workers), daemon=True).start()
+        threading.Thread(target=stage, args=(analyze_worker, analysis_workers, result_queue, 1), daemon=True).start()
+
+        while True:
+            item = result_queue.get()
+            if item is _DONE:
+                break
+            handle_result(*item)
 
-    for obra_id, pdf_url, doi in obras:
-        print(f"\n🔹 Processing Obra ID: {obra_id}")
+# ----------------------
+# Main loop
+# ----------------------
+def process_all_obras(download_workers=DOWNLOAD_WORKERS, extract_workers=EXTRACT_WORKERS,
+                      analysis_workers=ANALYSIS_WORKERS, use_cache=True, backend="gpt", prefilter=True,
+                      token_budget=text_prep.TOKEN_BUDGET, in_flight=IN_FLIGHT, batch=False,
+                      retry_failed=False, limit=None, reset=False):
+    """
+    Analysis threads block on the shared async engine, so there are at least
+    `in_flight` of them. With batch=True the documents that need the LLM are
+    collected during the run and sent as one provider batch at the end.
+    The work ledger limits the run to obras not analyzed yet (and not failed,
+    unless retry_failed); reset forgets it and starts the output tables over.
+    """
+    cache_store.recover_tables()
+    ledger = WorkLedger()
+    if reset:
+        ledger.reset()
+        for table, fields in ((TECN_TABLE, TECN_FIELDS), (OBRA_TECN_TABLE, LINK_FIELDS)):
+            cache_store.init_table(table, fields)
+            print(f"🗑️ Emptied {cache_store.table_path(table)}")
+    all_obras = read_obras()
+    obras = ledger.pending(all_obras, retry_failed, limit)
+    cache = TextCache() if use_cache else None
+    analysis_cache = AnalysisCache() if use_cache else None
+    sources = SourceCache() if use_cache else None
+    detector = LanguageDetector()
+    engine = create_engine(backend, in_flight)
+    print(f"Found {len(all_obras)} obras in cache, {len(obras)} to process ({ledger.summary()}).")
+
+    registry = TechRegistry(on_flush=ledger.mark_analyzed)
+    analyzed = {"keywords": 0, "llm": 0}
+    deferred = {}
+
+    def handle_result(obra_id, text, final_url, result):
+        print(f"\n🔹 Processed Obra ID: {obra_id}")
         try:
-            # Step 1: fetch PDF text
-            text, final_url = get_text_from_pdf_url(pdf_url, doi)
             if not text:
                 print(f"❌ No valid PDF or text found.")
                 print(f"⚠️ Skipping Obra ID {obra_id}, no text extracted.")
-                continue
-            else:
-                preview = text[:300].replace("\n", " ").strip()
-                print(f"📄 Text extracted for Obra ID {obra_id} ({len(text)} chars)")
-                print(f"🔗 Source URL used: {final_url}")
-                print(f"📝 Text preview: {preview}{'...' if len(text) > 300 else ''}")
-
-            # Step 2: analyze with Ollama
-            print(f"🤖 Analyzing text for Obra ID {obra_id}...")
-            try:
-                result = analyze_text_with_gpt(text)
-            except Exception as e:
-                print(f"⚠️ Analysis failed for Obra ID {obra_id}: {e}")
-                result = {"programming_languages": []}
-
+                return
+            if "error" in result:
+                print(f"⚠️ Analysis failed for Obra ID {obra_id}: {result['error']}")
+                ledger.mark(obra_id, FAILED, f"analysis: {result['error']}"[:200])
+                return
+            preview = text[:300].replace("\n", " ").strip()
+            print(f"📄 Text extracted for Obra ID {obra_id} ({len(text)} chars)")
+            print(f"🔗 Source URL used: {final_url}")
+            print(f"📝 Text preview: {preview}{'...' if len(text) > 300 else ''}")
+
+            if "deferred" in result:
+                deferred[obra_id] = result
+                print(f"📦 Obra ID {obra_id} queued for the batch analysis")
+                return
             languages = result.get("programming_languages", [])
-            print(f"📝 Obra ID {obra_id} languages detected: {languages}")
-
-            tech_map = load_tecnologias(TECN_CSV)  # { "Python": 89, "C": 90, ... }
-
-            for lang in languages:
-                if lang not in tech_map:
-                    tech_map[lang] = next_tecn_id
-                    append_to_csv(TECN_CSV, [next_tecn_id, lang], headers=["id","nombre"])
-                    next_tecn_id += 1
-
-                tecnologia_id = tech_map[lang]
-                append_to_csv(OBRA_TECN_CSV, [next_link_id, obra_id, tecnologia_id], headers=["id","obra_id","tecnologia_id"])
-                next_link_id += 1
+            source = result.get("source", "llm")
+            analyzed[source] += 1
+            print(f"📝 Obra ID {obra_id} languages detected ({source}): {languages}")
+            registry.add(obra_id, languages)
 
         except Exception as e:
             print(f"⚠️ Unexpected error processing Obra ID {obra_id}: {e}")
+            ledger.mark(obra_id, FAILED, f"error: {e}"[:200])
+
+    try:
+        run_pipeline(obras, handle_result, download_workers=download_workers, extract_workers=extract_workers,
+                     analysis_workers=max(analysis_workers, in_flight), cache=cache, analysis_cache=analysis_cache,
+                     backend=backend, detector=detector, prefilter=prefilter, token_budget=token_budget,
+                     engine=engine, defer=batch, sources=sources, ledger=ledger)
+        if deferred:
+            results = engine.analyze_many({obra_id: item["deferred"] for obra_id, item in deferred.items()})
+            for obra_id, item in deferred.items():
+                result = results[obra_id]
+                if "error" in result:
+                    ledger.mark(obra_id, FAILED, f"analysis: {result['error']}"[:200])
+                    continue
+                if analysis_cache is not None:
+                    analysis_cache.put(*item["cache_key"], result)
+                analyzed["llm"] += 1
+                print(f"📝 Obra ID {obra_id} languages detected (batch): {result['programming_languages']}")
+                registry.add(obra_id, result["programming_languages"])
+    finally:
+        registry.flush()
+        engine.close()
+    print(f"📒 Work ledger: {ledger.summary()}")
+    if prefilter:
+        print(f"🔎 Keyword pre-classifier: {analyzed['keywords']} obras resolved locally, {analyzed['llm']} sent to the LLM")
+    if cache:
+        print(f"📦 Text cache: {cache.stats()}")
+        print(f"🧠 Analysis cache: {analysis_cache.stats()}")
+        print(f"🧭 Source cache: {sources.stats()}")
+    print(f"🧩 Landing pages: {html_resolver.stats()}")
 
 
 if __name__ == "__main__":
-    #Uncomment if you are testing runs 
-    """for csv_file in [TECN_CSV, OBRA_TECN_CSV]:
-        if os.path.exists(csv_file):
-            os.remove(csv_file)
-            print(f"🗑️ Deleted old CSV: {csv_file}")"""
-    process_all_obras()
+    parser = argparse.ArgumentParser(description="Download, extract and analyze the cached obras.")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--extract-workers", type=int, default=EXTRACT_WORKERS)
+    parser.add_argument("--analysis-workers", type=int, default=ANALYSIS_WORKERS)
+    parser.add_argument("--backend", choices=["gpt", "ollama"], default="gpt", help="LLM used for the analysis")
+    parser.add_argument("--no-cache", action="store_true", help="ignore the text, analysis and source caches")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="send every document to the LLM instead of resolving clear cases by keywords")
+    parser.add_argument("--token-budget", type=int, default=text_prep.TOKEN_BUDGET,
+                        help="max tokens of article text per LLM call (0 sends the whole text)")
+    parser.add_argument("--in-flight", type=int, default=IN_FLIGHT, help="LLM requests outstanding at once")
+    parser.add_argument("--batch", action="store_true",
+                        help="send the documents that need the LLM as one provider batch after the run (OpenAI Batch API)")
+    parser.add_argument("--retry-failed", action="store_true", help="also process obras that failed in earlier runs")
+    parser.add_argument("--limit", type=int, help="process at most this many pending obras")
+    parser.add_argument("--reset", action="store_true",
+                        help="forget the work ledger and empty tecnologia/obra_tecnologia before running")
+    args = parser.parse_args()
+    process_all_obras(args.download_workers, args.extract_workers, args.analysis_workers,
+                      use_cache=not args.no_cache, backend=args.backend, prefilter=not args.no_prefilter,
+                      token_budget=args.token_budget, in_flight=args.in_flight, batch=args.batch,
+                      retry_failed=args.retry_failed, limit=args.limit, reset=args.reset)
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_CACHE_FILE = os.path.join(BASE_DIR, "cache", "sources.sqlite")
+
+DEAD_URL_TTL = 7 * 24 * 3600       # a URL that served no usable text
+TRANSIENT_TTL = 3600               # a URL that timed out or errored
+FOUND_LOOKUP_TTL = 30 * 24 * 3600  # Unpaywall/ACM answers
+MISSING_LOOKUP_TTL = 3 * 24 * 3600
+HOST_FAILURE_THRESHOLD = 5         # consecutive failures before a host is skipped
+HOST_COOLDOWN = 3600
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+class SourceCache:
+    """
+    Where each DOI's text was last found, which URLs recently failed, what
+    Unpaywall/ACM answered, and a circuit breaker per host: after
+    HOST_FAILURE_THRESHOLD consecutive transport failures a host is skipped for
+    HOST_COOLDOWN seconds. Persistent, so reruns skip known-bad sources.
+    """
+    def __init__(self, path=SOURCE_CACHE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS resolved (doi TEXT PRIMARY KEY, url TEXT NOT NULL, updated_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS dead_urls (url TEXT PRIMARY KEY, reason TEXT, expires_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, url TEXT, expires_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, failures INTEGER NOT NULL, open_until REAL NOT NULL);
+        """)
+        self.db.commit()
+
+    def resolved_url(self, doi):
+        if not doi:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT url FROM resolved WHERE doi = ?", (doi,)).fetchone()
+            return row[0] if row else None
+
+    def is_dead(self, url):
+        """Known-bad URL or host; counted in stats() as a skipped fetch."""
+        with self.lock:
+            now = time.time()
+            dead = self.db.execute("SELECT 1 FROM dead_urls WHERE url = ? AND expires_at > ?", (url, now)).fetchone() \
+                or self.db.execute("SELECT 1 FROM hosts WHERE host = ? AND open_until > ?", (host_of(url), now)).fetchone()
+            if dead:
+                self.skipped += 1
+            return bool(dead)
+
+    def mark_failed(self, url, reason, ttl=DEAD_URL_TTL, transport=False):
+        """
+        Remember a URL that gave no usable text. Only transport failures
+        (connection errors, timeouts, 429/5xx) count against the host's breaker;
+        a host that answered with the wrong content is working.
+        """
+        with self.lock:
+            now = time.time()
+            self.db.execute("INSERT OR REPLACE INTO dead_urls (url, reason, expires_at) VALUES (?, ?, ?)",
+                            (url, reason, now + ttl))
+            self.record_host(url, ok=not transport, now=now)
+            self.db.commit()
+
+    def mark_ok(self, url, doi=None):
+        with self.lock:
+            self.db.execute("DELETE FROM dead_urls WHERE url = ?", (url,))
+            if doi:
+                self.db.execute("INSERT OR REPLACE INTO resolved (doi, url, updated_at) VALUES (?, ?, ?)",
+                                (doi, url, time.time()))
+            self.record_host(url, ok=True)
+            self.db.commit()
+
+    def record_host(self, url, ok, now=None):
+        """Count a host success/failure (caller holds the lock); opens the breaker at the threshold."""
+        now = now or time.time()
+        host = host_of(url)
+        if ok:
+            self.db.execute("DELETE FROM hosts WHERE host = ?", (host,))
+            return
+        row = self.db.execute("SELECT failures FROM hosts WHERE host = ?", (host,)).fetchone()
+        failures = (row[0] if row else 0) + 1
+        open_until = now + HOST_COOLDOWN if failures >= HOST_FAILURE_THRESHOLD else 0
+        if open_until:
+            print(f"⛔ Skipping {host} for {HOST_COOLDOWN // 60} min after {failures} failures")
+            failures = 0
+        self.db.execute("INSERT OR REPLACE INTO hosts (host, failures, open_until) VALUES (?, ?, ?)",
+                        (host, failures, open_until))
+
+    def host_result(self, url, ok):
+        with self.lock:
+            self.record_host(url, ok)
+            self.db.commit()
+
+    def lookup(self, key):
+        """(True, url or None) for a fresh memoized fallback lookup, else (False, None)."""
+        with self.lock:
+            row = self.db.execute("SELECT url FROM lookups WHERE key = ? AND expires_at > ?",
+                                  (key, time.time())).fetchone()
+            return (True, row[0]) if row else (False, None)
+
+    def store_lookup(self, key, url):
+        ttl = FOUND_LOOKUP_TTL if url else MISSING_LOOKUP_TTL
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO lookups (key, url, expires_at) VALUES (?, ?, ?)",
+                            (key, url, time.time() + ttl))
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            resolved = self.db.execute("SELECT COUNT(*) FROM resolved").fetchone()[0]
+            dead = self.db.execute("SELECT COUNT(*) FROM dead_urls WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        return f"{resolved} DOIs resolved, {dead} dead URLs, {self.skipped} known-bad fetches skipped"
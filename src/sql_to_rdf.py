@@ -2,13 +2,18 @@ import psycopg2
 from rdflib import Graph, Namespace, Literal
 from rdflib.namespace import RDF, SKOS, XSD
 import os
+import gzip
+import json
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import http_client
+from export_state import ExportState
 # --- Namespaces ---
 SCHEMA = Namespace("https://schema.org/")
 OPENALEX = Namespace("https://openalex.org/")
-g = Graph()
-g.bind("schema", SCHEMA)
-g.bind("skos", SKOS)
-g.bind("openalex", OPENALEX)
 
 # --- PostgreSQL connection ---
 DB_PARAMS = {
@@ -19,102 +24,390 @@ DB_PARAMS = {
     "password": "passPSQL",
 }
 
-try:
-    conn = psycopg2.connect(**DB_PARAMS)
-    cur = conn.cursor()
-    print("Connected to database ✅")
-
-    # --- 1. TEMÁTICA ---
-    cur.execute("SELECT id, nombre_campo FROM tematica;")
-    for tmid, nombre in cur.fetchall():
-        tema_uri = OPENALEX[f"tematica_{tmid}"]
-        g.add((tema_uri, RDF.type, SKOS.Concept))
-        if nombre:
-            g.add((tema_uri, SKOS.prefLabel, Literal(nombre)))
-
-    print("Mapped table: tematica ✅")
-
-    # tematica_contenida → skos:broader/narrower
-    cur.execute("SELECT tematica_padre_id, tematica_hijo_id FROM tematica_contenida;")
-    for parent, child in cur.fetchall():
-        if parent and child:
-            parent_uri = OPENALEX[f"tematica_{parent}"]
-            child_uri = OPENALEX[f"tematica_{child}"]
-            g.add((parent_uri, SKOS.narrower, child_uri))
-            g.add((child_uri, SKOS.broader, parent_uri))
-
-    # --- 2. TECNOLOGÍA ---
-    cur.execute("SELECT id, nombre, tipo, version FROM tecnologia;")
-    for tid, nombre, tipo, version in cur.fetchall():
-        tech_uri = OPENALEX[f"tecnologia_{tid}"]
-        g.add((tech_uri, RDF.type, SCHEMA.SoftwareApplication))
-        if nombre:
-            g.add((tech_uri, SCHEMA.name, Literal(nombre)))
-        if tipo:
-            g.add((tech_uri, SCHEMA.applicationCategory, Literal(tipo)))
-        if version:
-            g.add((tech_uri, SCHEMA.softwareVersion, Literal(version)))
-
-    print("Mapped table: tecnologia ✅")
-
-    # --- 3. OBRA ---
-    cur.execute("""
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # directory where this script lives
+OUTPUT_DIR = os.path.join(BASE_DIR, "../db")
+ITERSIZE = 2000          # rows fetched per round trip by the server-side cursors
+CHUNK_TRIPLES = 20000    # triples serialized and written per chunk
+FORMAT_EXTENSIONS = {"turtle": "ttl", "nt": "nt"}
+SHARDS_DIR = os.path.join(OUTPUT_DIR, "rdf_shards")
+PARTITION_SIZE = 50000   # ids per shard
+# SPARQL Update endpoint of the GraphDB repository (docker/graphdb maps 7200 to 8000)
+GRAPHDB_URL = os.environ.get("GRAPHDB_URL", "http://localhost:8000/repositories/openalex/statements")
+UPDATE_BATCH_TRIPLES = 5000
+EXPORT_OVERLAP = "10 minutes"   # re-check rows loaded slightly before the last export started
+
+def new_graph():
+    g = Graph()
+    g.bind("schema", SCHEMA)
+    g.bind("skos", SKOS)
+    g.bind("openalex", OPENALEX)
+    return g
+
+# --- Row -> triples mappers ---
+def tematica_triples(tmid, nombre):
+    tema_uri = OPENALEX[f"tematica_{tmid}"]
+    triples = [(tema_uri, RDF.type, SKOS.Concept)]
+    if nombre:
+        triples.append((tema_uri, SKOS.prefLabel, Literal(nombre)))
+    return triples
+
+# tematica_contenida → skos:broader/narrower
+def tematica_contenida_triples(_id, parent, child):
+    if not (parent and child):
+        return []
+    parent_uri = OPENALEX[f"tematica_{parent}"]
+    child_uri = OPENALEX[f"tematica_{child}"]
+    return [(parent_uri, SKOS.narrower, child_uri), (child_uri, SKOS.broader, parent_uri)]
+
+def tecnologia_triples(tid, nombre, tipo, version):
+    tech_uri = OPENALEX[f"tecnologia_{tid}"]
+    triples = [(tech_uri, RDF.type, SCHEMA.SoftwareApplication)]
+    if nombre:
+        triples.append((tech_uri, SCHEMA.name, Literal(nombre)))
+    if tipo:
+        triples.append((tech_uri, SCHEMA.applicationCategory, Literal(tipo)))
+    if version:
+        triples.append((tech_uri, SCHEMA.softwareVersion, Literal(version)))
+    return triples
+
+def obra_triples(oid, doi, direccion_fuente, titulo, abstract, fecha_publicacion,
+                 idioma, num_citas, fwci, tematica_id):
+    obra_uri = OPENALEX[f"obra_{oid}"]
+    triples = [(obra_uri, RDF.type, SCHEMA.ScholarlyArticle)]
+    if doi:
+        triples.append((obra_uri, SCHEMA.identifier, Literal(doi)))
+    if direccion_fuente:
+        triples.append((obra_uri, SCHEMA.url, Literal(direccion_fuente)))
+    if titulo:
+        triples.append((obra_uri, SCHEMA.name, Literal(titulo)))
+    if abstract:
+        triples.append((obra_uri, SCHEMA.abstract, Literal(abstract)))
+    if fecha_publicacion:
+        triples.append((obra_uri, SCHEMA.datePublished, Literal(fecha_publicacion, datatype=XSD.date)))
+    if idioma:
+        triples.append((obra_uri, SCHEMA.inLanguage, Literal(idioma)))
+    if num_citas is not None:
+        triples.append((obra_uri, SCHEMA.citationCount, Literal(num_citas, datatype=XSD.integer)))
+    if fwci is not None:
+        triples.append((obra_uri, SCHEMA.metric, Literal(fwci, datatype=XSD.float)))
+    if tematica_id:
+        triples.append((obra_uri, SCHEMA.about, OPENALEX[f"tematica_{tematica_id}"]))
+    return triples
+
+# obra_tecnologia → schema:mentions
+def obra_tecnologia_triples(_id, oid, tid):
+    if not (oid and tid):
+        return []
+    return [(OPENALEX[f"obra_{oid}"], SCHEMA.mentions, OPENALEX[f"tecnologia_{tid}"])]
+
+# (table, query, mapper) in export order; every query selects the row id first
+EXPORTS = [
+    ("tematica", "SELECT id, nombre_campo FROM tematica", tematica_triples),
+    ("tematica_contenida", "SELECT id, tematica_padre_id, tematica_hijo_id FROM tematica_contenida", tematica_contenida_triples),
+    ("tecnologia", "SELECT id, nombre, tipo, version FROM tecnologia", tecnologia_triples),
+    ("obra", """
         SELECT id, doi, direccion_fuente, titulo, abstract, fecha_publicacion,
                idioma, num_citas, fwci, tematica_id
-        FROM obra;
-    """)
-    for (
-        oid, doi, direccion_fuente, titulo, abstract, fecha_publicacion,
-        idioma, num_citas, fwci, tematica_id
-    ) in cur.fetchall():
-        obra_uri = OPENALEX[f"obra_{oid}"]
-        g.add((obra_uri, RDF.type, SCHEMA.ScholarlyArticle))
-        if doi:
-            g.add((obra_uri, SCHEMA.identifier, Literal(doi)))
-        if direccion_fuente:
-            g.add((obra_uri, SCHEMA.url, Literal(direccion_fuente)))
-        if titulo:
-            g.add((obra_uri, SCHEMA.name, Literal(titulo)))
-        if abstract:
-            g.add((obra_uri, SCHEMA.abstract, Literal(abstract)))
-        if fecha_publicacion:
-            g.add((obra_uri, SCHEMA.datePublished, Literal(fecha_publicacion, datatype=XSD.date)))
-        if idioma:
-            g.add((obra_uri, SCHEMA.inLanguage, Literal(idioma)))
-        if num_citas is not None:
-            g.add((obra_uri, SCHEMA.citationCount, Literal(num_citas, datatype=XSD.integer)))
-        if fwci is not None:
-            g.add((obra_uri, SCHEMA.metric, Literal(fwci, datatype=XSD.float)))
-        if tematica_id:
-            g.add((obra_uri, SCHEMA.about, OPENALEX[f"tematica_{tematica_id}"]))
-
-    print("Mapped table: obra ✅")
-
-    # obra_tecnologia → schema:mentions
-    cur.execute("SELECT obra_id, tecnologia_id FROM obra_tecnologia;")
-    for oid, tid in cur.fetchall():
-        if oid and tid:
-            g.add((OPENALEX[f"obra_{oid}"], SCHEMA.mentions, OPENALEX[f"tecnologia_{tid}"]))
-
-    print("Mapped relationships ✅")
-
-    # --- 4. EXPORT ---
-    base_dir = os.path.dirname(os.path.abspath(__file__))  # directory where this script lives
-    output_dir = os.path.join(base_dir, "../db")
-    output_file = os.path.join(output_dir, "openalex_graph.ttl")
-
-    os.makedirs(output_dir, exist_ok=True)
-    g.serialize(destination=output_file, format="turtle")
-
-except psycopg2.Error as e:
-    print("❌ Database error:", e)
-
-except Exception as e:
-    print("❌ Unexpected error:", e)
-
-finally:
-    if 'cur' in locals():
-        cur.close()
-    if 'conn' in locals():
+        FROM obra
+    """, obra_triples),
+    ("obra_tecnologia", "SELECT id, obra_id, tecnologia_id FROM obra_tecnologia", obra_tecnologia_triples),
+]
+
+class TripleWriter:
+    """
+    Serializes triples in fixed-size chunks straight to a file, so memory does
+    not grow with the corpus. Turtle chunks share the prefixes written once at
+    the top; a row's triples always land in the same chunk.
+    """
+    def __init__(self, path, fmt="turtle", chunk_triples=CHUNK_TRIPLES):
+        self.path = path
+        self.fmt = fmt
+        self.chunk_triples = chunk_triples
+        self.pending = []
+        self.count = 0
+        opener = gzip.open if path.endswith(".gz") else open
+        self.file = opener(f"{path}.tmp", "wt", encoding="utf-8")
+        if fmt == "turtle":
+            for prefix, namespace in new_graph().namespaces():
+                if prefix in ("schema", "skos", "openalex", "rdf", "xsd"):
+                    self.file.write(f"@prefix {prefix}: <{namespace}> .\n")
+            self.file.write("\n")
+
+    def add(self, triples):
+        self.pending.extend(triples)
+        if len(self.pending) >= self.chunk_triples:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        g = new_graph()
+        for triple in self.pending:
+            g.add(triple)
+        text = g.serialize(format=self.fmt)
+        if self.fmt == "turtle":
+            text = "\n".join(line for line in text.splitlines() if not line.startswith("@prefix")).strip() + "\n\n"
+        self.file.write(text)
+        self.count += len(g)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+
+def stream_rows(conn, table, query, itersize=ITERSIZE, params=None):
+    """Iterate over a query through a named (server-side) cursor."""
+    with conn.cursor(name=f"export_{table}") as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        yield from cur
+
+def export_graph(conn, output_file, fmt="turtle", itersize=ITERSIZE):
+    writer = TripleWriter(output_file, fmt)
+    try:
+        for table, query, mapper in EXPORTS:
+            for row in stream_rows(conn, table, query, itersize):
+                writer.add(mapper(*row))
+            print(f"Mapped table: {table} ✅")
+    except BaseException:
+        writer.file.close()
+        os.remove(f"{output_file}.tmp")
+        raise
+    writer.close()
+    print(f"Wrote {writer.count} triples to {output_file} ✅")
+
+# --- Sharded export ---
+def id_partitions(conn, partition_size=PARTITION_SIZE):
+    """(table, first id, last id) ranges covering every exported table."""
+    partitions = []
+    with conn.cursor() as cur:
+        for table, _, _ in EXPORTS:
+            cur.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+            lo, hi = cur.fetchone()
+            if lo is None:
+                continue
+            for start in range(lo, hi + 1, partition_size):
+                partitions.append((table, start, min(start + partition_size - 1, hi)))
+    return partitions
+
+def export_partition(db_params, shards_dir, table, id_from, id_to, itersize=ITERSIZE):
+    """Write one table id range as a gzipped N-Triples shard; runs in a worker process."""
+    query, mapper = next((q, m) for t, q, m in EXPORTS if t == table)
+    path = os.path.join(shards_dir, f"{table}_{id_from:09d}_{id_to:09d}.nt.gz")
+    writer = TripleWriter(path, "nt")
+    rows = 0
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor(name=f"export_{table}_{id_from}") as cur:
+            cur.itersize = itersize
+            cur.execute(f"{query} WHERE id BETWEEN %s AND %s", (id_from, id_to))
+            for row in cur:
+                writer.add(mapper(*row))
+                rows += 1
+    finally:
         conn.close()
-    print("PostgreSQL connection closed 🔒")
+    writer.close()
+    return {"file": os.path.basename(path), "table": table, "id_from": id_from, "id_to": id_to,
+            "rows": rows, "triples": writer.count, "bytes": os.path.getsize(path)}
+
+def export_shards(conn, shards_dir=SHARDS_DIR, workers=None, partition_size=PARTITION_SIZE, itersize=ITERSIZE):
+    """Export every id partition in a process pool and write manifest.json next to the shards."""
+    start = time.perf_counter()
+    os.makedirs(shards_dir, exist_ok=True)
+    for name in os.listdir(shards_dir):
+        if name.endswith(".nt.gz") or name == "manifest.json":
+            os.remove(os.path.join(shards_dir, name))
+
+    partitions = id_partitions(conn, partition_size)
+    shards = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(export_partition, DB_PARAMS, shards_dir, *p, itersize) for p in partitions]
+        for future in as_completed(futures):
+            shard = future.result()
+            shards.append(shard)
+            print(f"Wrote shard {shard['file']} ({shard['triples']} triples) ✅")
+
+    shards.sort(key=lambda s: s["file"])
+    manifest = {
+        "format": "application/n-triples",
+        "compression": "gzip",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "triples": sum(s["triples"] for s in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(shards_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {len(shards)} shards with {manifest['triples']} triples to {shards_dir} "
+          f"in {time.perf_counter() - start:.2f}s ✅")
+
+# --- Incremental export ---
+def serialize(triples):
+    """Triples as SPARQL/Turtle statements (long literals stay triple-quoted)."""
+    return [f"{s.n3()} {p.n3()} {o.n3()} ." for s, p, o in triples]
+
+def sparql_update(deletes, inserts):
+    operations = []
+    if deletes:
+        operations.append("DELETE DATA {\n" + "\n".join(deletes) + "\n}")
+    if inserts:
+        operations.append("INSERT DATA {\n" + "\n".join(inserts) + "\n}")
+    return " ;\n".join(operations)
+
+def graph_store_push(endpoint):
+    """Send each batch as one SPARQL Update request, i.e. one transaction in the store."""
+    def push(update):
+        response = http_client.post(endpoint, data=update.encode("utf-8"), timeout=300,
+                                    headers={"Content-Type": "application/sparql-update; charset=utf-8"})
+        if response.status_code >= 300:
+            raise RuntimeError(f"Graph store rejected the update ({response.status_code}): {response.text[:200]}")
+    return push
+
+def changeset_writer(directory):
+    """Write each batch to a numbered .ru file instead of pushing it."""
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    counter = iter(range(1, 1 << 30))
+    def push(update):
+        path = os.path.join(directory, f"changeset_{stamp}_{next(counter):05d}.ru")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(update + "\n")
+    return push
+
+class UpdateBatcher:
+    """
+    Collects per-row triple differences into DELETE DATA / INSERT DATA batches.
+    Triples are reference-counted across rows: one is inserted when its first
+    row asserts it and deleted only when no row does any more. The export
+    state is only updated once a batch has been pushed, so a failed run is
+    simply repeated.
+    """
+    def __init__(self, push, state, batch_triples=UPDATE_BATCH_TRIPLES):
+        self.push = push
+        self.state = state
+        self.batch_triples = batch_triples
+        self.delta, self.changes = Counter(), []
+        self.deleted = self.inserted = self.rows = self.batches = 0
+
+    def add(self, table, row_id, old, new):
+        """old/new: serialized triples of the row, new=None when the row is gone."""
+        old_set, new_set = set(old or []), set(new or [])
+        if old_set == new_set and (old is None) == (new is None):
+            return
+        self.delta.update(new_set - old_set)
+        self.delta.subtract(old_set - new_set)
+        self.changes.append((table, row_id, new))
+        if len(self.delta) >= self.batch_triples:
+            self.flush()
+
+    def flush(self):
+        if not self.changes:
+            return
+        current = self.state.refs(self.delta)
+        refs = {t: max(0, current.get(t, 0) + d) for t, d in self.delta.items() if d}
+        deletes = [t for t, n in refs.items() if n == 0 and current.get(t, 0) > 0]
+        inserts = [t for t, n in refs.items() if n > 0 and current.get(t, 0) == 0]
+        if deletes or inserts:
+            self.push(sparql_update(deletes, inserts))
+            self.batches += 1
+        self.state.save(self.changes, refs)
+        self.deleted += len(deletes)
+        self.inserted += len(inserts)
+        self.rows += len(self.changes)
+        self.delta, self.changes = Counter(), []
+
+def load_state_covers(conn, table):
+    """True when every row of the table has a load_state entry (i.e. it was loaded with --sync)."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT NOT EXISTS (
+                SELECT 1 FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM load_state s WHERE s.table_name = %s AND s.row_id = t.id)
+            )
+        """, (table,))
+        return cur.fetchone()[0]
+
+def export_incremental(conn, push, state=None, batch_triples=UPDATE_BATCH_TRIPLES, full=False, itersize=ITERSIZE):
+    """
+    Push only what changed since the last export. Rows are narrowed down with
+    load_state.updated_at when the table is fully tracked there, otherwise (or
+    with full=True) every row is mapped and compared with the exported state.
+    Rows that disappeared from the database have their triples deleted.
+    """
+    state = state or ExportState()
+    with conn.cursor() as cur:
+        cur.execute("SELECT now()")
+        started = cur.fetchone()[0].isoformat()
+    since = None if full else state.last_export()
+    batcher = UpdateBatcher(push, state, batch_triples)
+
+    for table, query, mapper in EXPORTS:
+        params = None
+        if since and load_state_covers(conn, table):
+            query = f"""{query} WHERE id IN (
+                SELECT row_id FROM load_state
+                WHERE table_name = %s AND updated_at > %s::timestamptz - interval '{EXPORT_OVERLAP}')"""
+            params = (table, since)
+        checked = 0
+        for row in stream_rows(conn, table, query, itersize, params):
+            previous = state.get(table, row[0])
+            batcher.add(table, row[0], previous and previous[1], serialize(mapper(*row)))
+            checked += 1
+
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT id FROM {table}")
+            existing = {r[0] for r in cur}
+        for row_id in sorted(state.row_ids(table) - existing):
+            batcher.add(table, row_id, state.get(table, row_id)[1], None)
+        print(f"Checked {checked} rows of {table} {'changed since ' + since if params else '(full compare)'} ✅")
+
+    batcher.flush()
+    state.set_last_export(started)
+    print(f"Pushed {batcher.rows} changed rows in {batcher.batches} batches: "
+          f"{batcher.deleted} triples deleted, {batcher.inserted} inserted ✅")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the PostgreSQL tables as an RDF graph.")
+    parser.add_argument("--format", choices=list(FORMAT_EXTENSIONS), default="turtle")
+    parser.add_argument("--itersize", type=int, default=ITERSIZE, help="rows per server-side cursor fetch")
+    parser.add_argument("--sharded", action="store_true",
+                        help=f"write gzipped N-Triples shards plus a manifest to {os.path.relpath(SHARDS_DIR, BASE_DIR)}")
+    parser.add_argument("--workers", type=int, default=None, help="processes for --sharded (default: CPU count)")
+    parser.add_argument("--partition-size", type=int, default=PARTITION_SIZE, help="ids per shard for --sharded")
+    parser.add_argument("--incremental", action="store_true",
+                        help="push only rows changed since the last export to the graph store as SPARQL updates")
+    parser.add_argument("--endpoint", default=GRAPHDB_URL, help="SPARQL Update endpoint for --incremental")
+    parser.add_argument("--changesets", metavar="DIR", help="with --incremental, write .ru changeset files instead of pushing")
+    parser.add_argument("--batch-triples", type=int, default=UPDATE_BATCH_TRIPLES, help="triples per update batch")
+    parser.add_argument("--full", action="store_true", help="with --incremental, compare every row instead of using load_state")
+    args = parser.parse_args()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        print("Connected to database ✅")
+
+        # --- EXPORT ---
+        if args.sharded:
+            export_shards(conn, workers=args.workers, partition_size=args.partition_size, itersize=args.itersize)
+            return
+        if args.incremental:
+            push = changeset_writer(args.changesets) if args.changesets else graph_store_push(args.endpoint)
+            export_incremental(conn, push, batch_triples=args.batch_triples, full=args.full, itersize=args.itersize)
+            return
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        output_file = os.path.join(OUTPUT_DIR, f"openalex_graph.{FORMAT_EXTENSIONS[args.format]}")
+        export_graph(conn, output_file, args.format, args.itersize)
+
+    except psycopg2.Error as e:
+        print("❌ Database error:", e)
+
+    except Exception as e:
+        print("❌ Unexpected error:", e)
+
+    finally:
+        if 'conn' in locals():
+            conn.close()
+        print("PostgreSQL connection closed 🔒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import re
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts fall back to a characters-per-token estimate
+    tiktoken = None
+
+# A "References"/"Bibliography" heading on a line of its own, optionally numbered ("7.", "VII.")
+REFERENCES_RE = re.compile(
+    r"^[ \t]*(?:(?:\d+(?:\.\d+)*|[IVXLC]+)\.?[ \t]+)?"
+    r"(?:References|REFERENCES|Bibliography|BIBLIOGRAPHY|Works Cited|WORKS CITED|Literature Cited|Referencias|Bibliografía)"
+    r"[ \t]*:?[ \t]*$",
+    re.M,
+)
+MIN_BODY_FRACTION = 0.2  # headings before this point are table-of-contents entries, not the section
+CHARS_PER_TOKEN = 4      # heuristic used when tiktoken or its encoding is unavailable
+TOKEN_BUDGET = 6000      # tokens of article text sent to the LLM per document
+HEAD_CHARS = 2000        # title, abstract and start of the introduction, always kept
+PASSAGE_CHARS = 300      # context kept on each side of a language mention
+EXCERPT_SEPARATOR = "\n[...]\n"
+ENCODING_NAME = "o200k_base"
+REDUCER_VERSION = 1      # bump when reduce_text changes what it keeps; part of the analysis cache key
+
+_encoding = {}
+_encoding_lock = threading.Lock()
+
+def encoding():
+    """
+    The tokenizer, loaded on first use; None when tiktoken is not installed or
+    its BPE file cannot be fetched (offline), so counts use CHARS_PER_TOKEN.
+    """
+    with _encoding_lock:
+        if ENCODING_NAME not in _encoding:
+            try:
+                _encoding[ENCODING_NAME] = tiktoken.get_encoding(ENCODING_NAME) if tiktoken else None
+            except Exception as e:
+                print(f"⚠️ tiktoken encoding {ENCODING_NAME} unavailable ({e}), estimating tokens from characters")
+                _encoding[ENCODING_NAME] = None
+        return _encoding[ENCODING_NAME]
+
+def reducer_version():
+    """REDUCER_VERSION plus how tokens are counted, since the fallback cuts at different points."""
+    return f"{REDUCER_VERSION}-{ENCODING_NAME if encoding() else 'chars'}"
+
+def strip_references(text):
+    """Cut the text at its last References/Bibliography heading."""
+    cut = None
+    for match in REFERENCES_RE.finditer(text):
+        if match.start() >= len(text) * MIN_BODY_FRACTION:
+            cut = match.start()
+    return text if cut is None else text[:cut]
+
+def count_tokens(text):
+    enc = encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate_tokens(text, budget):
+    enc = encoding()
+    if enc is not None:
+        tokens = enc.encode(text, disallowed_special=())
+        return text if len(tokens) <= budget else enc.decode(tokens[:budget])
+    return text[:budget * CHARS_PER_TOKEN]
+
+def passage_spans(text, pattern, radius=PASSAGE_CHARS):
+    """Merged (start, end) windows around every match of `pattern`."""
+    spans = []
+    for match in pattern.finditer(text):
+        start, end = max(0, match.start() - radius), min(len(text), match.end() + radius)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+def reduce_text(text, pattern, budget=TOKEN_BUDGET):
+    """
+    What the LLM needs to see of an article: the text before References, and
+    when that is over `budget` tokens, the opening HEAD_CHARS plus the
+    passages around `pattern` matches (language mentions), in document order,
+    cut off at the budget.
+    """
+    body = strip_references(text)
+    if count_tokens(body) <= budget:
+        return body
+
+    spans = [(0, min(HEAD_CHARS, len(body)))]
+    for start, end in passage_spans(body, pattern):
+        if start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+        else:
+            spans.append((start, end))
+
+    excerpts, used = [], 0
+    for start, end in spans:
+        excerpt = body[start:end].strip()
+        tokens = count_tokens(excerpt)
+        if used + tokens > budget:
+            excerpts.append(truncate_tokens(excerpt, max(0, budget - used)))
+            break
+        excerpts.append(excerpt)
+        used += tokens + count_tokens(EXCERPT_SEPARATOR)
+    return EXCERPT_SEPARATOR.join(e for e in excerpts if e)
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEDGER_FILE = os.path.join(BASE_DIR, "cache", "work_ledger.sqlite")
+
+EXTRACTED = "extracted"   # text downloaded/extracted and in the text cache, not yet analyzed
+ANALYZED = "analyzed"     # languages written to tecnologia/obra_tecnologia
+FAILED = "failed"
+
+def work_key(obra):
+    """What identifies the work behind an (id, direccion_fuente, doi) obra across harvests."""
+    _, pdf_url, doi = obra
+    return doi or pdf_url or None
+
+class WorkLedger:
+    """
+    Per-obra progress of process_pdf, so a rerun only picks up obras that
+    are pending (or failed, when asked). Every status change is its own
+    transaction; ANALYZED is only written once the obra's links are on disk.
+    Entries also record the obra's work_key: a full harvest renumbers obras,
+    and an id whose key changed is a different work, so it is pending again.
+    """
+    def __init__(self, path=LEDGER_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS obras (
+                obra_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                reason TEXT,
+                source_url TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(obras)")}
+        if "work_key" not in columns:
+            self.db.execute("ALTER TABLE obras ADD COLUMN work_key TEXT")
+        self.db.commit()
+        self.work_keys = {}  # obra_id -> work_key of the obras handed out by pending()
+
+    def statuses(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT obra_id, status FROM obras"))
+
+    def pending(self, obras, retry_failed=False, limit=None):
+        """
+        The obras still to do: never analyzed, and not failed unless
+        retry_failed. An entry recorded for another work_key does not count.
+        """
+        with self.lock:
+            recorded = {obra_id: (status, key) for obra_id, status, key
+                        in self.db.execute("SELECT obra_id, status, work_key FROM obras")}
+        skip = {ANALYZED} if retry_failed else {ANALYZED, FAILED}
+        todo = []
+        for obra in obras:
+            status, key = recorded.get(obra[0], (None, None))
+            if status not in skip or key != work_key(obra):
+                todo.append(obra)
+        todo = todo[:limit] if limit else todo
+        self.work_keys.update((obra[0], work_key(obra)) for obra in todo)
+        return todo
+
+    def mark(self, obra_id, status, reason=None, source_url=None):
+        with self.lock, self.db:
+            self.db.execute("""
+                INSERT INTO obras (obra_id, status, reason, source_url, attempts, updated_at, work_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (obra_id) DO UPDATE SET
+                    status = excluded.status, reason = excluded.reason,
+                    source_url = CASE WHEN excluded.work_key IS obras.work_key
+                                      THEN COALESCE(excluded.source_url, obras.source_url) ELSE excluded.source_url END,
+                    attempts = CASE WHEN excluded.work_key IS obras.work_key
+                                    THEN obras.attempts + excluded.attempts ELSE excluded.attempts END,
+                    updated_at = excluded.updated_at, work_key = excluded.work_key
+            """, (obra_id, status, reason, source_url, int(status == FAILED), time.time(), self.work_keys.get(obra_id)))
+
+    def mark_analyzed(self, obra_ids):
+        for obra_id in obra_ids:
+            self.mark(obra_id, ANALYZED)
+
+    def reset(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM obras")
+
+    def summary(self):
+        counts = Counter(self.statuses().values())
+        return ", ".join(f"{counts[s]} {s}" for s in (ANALYZED, EXTRACTED, FAILED))
@@ -0,0 +1,21 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def stand_in_server(request, monkeypatch):
+    """
+    Base URL of a local HTTP server running the handler class the test passes
+    in: @pytest.mark.parametrize("stand_in_server", [Handler], indirect=True).
+    """
+    monkeypatch.setattr(request.param, "log_message", lambda self, *args: None)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), request.param)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+import alex_extractor
+
+
+def test_incremental_refuses_to_run_over_an_unfinished_harvest(tmp_path, monkeypatch, capsys):
+    checkpoint = tmp_path / "harvest_checkpoint.json"
+    checkpoint.write_text("{}")
+    monkeypatch.setattr(alex_extractor, "CHECKPOINT_FILE", str(checkpoint))
+    monkeypatch.setattr(alex_extractor, "sync_updated_works", lambda since: pytest.fail("delta sync started"))
+    monkeypatch.setattr(sys, "argv", ["alex_extractor.py", "--incremental", "--since", "2025-01-01"])
+    alex_extractor.main()
+    assert "--resume" in capsys.readouterr().out
+    assert checkpoint.exists()
+
+
+@pytest.mark.parametrize("index", [
+    {"Software": [0], "for": [1], "science": [2]},
+    {"a": [-1], "b": [0]},
+    {"a": [0], "b": [5]},
+    {"b": [1], "a": [0, 2]},
+    {},
+    None,
+])
+def test_reconstruct_abstracts_matches_reconstruct_abstract(index):
+    assert alex_extractor.reconstruct_abstracts([index]) == [alex_extractor.reconstruct_abstract(index)]
@@ -0,0 +1,50 @@
+import pytest
+
+import cache_store
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_store, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("content, repaired", [
+    (b"id,nombre\r\n1,Python\r\n", b"id,nombre\r\n1,Python\r\n"),
+    (b"id,nombre\r\n1,Python\r\n2,Rust", b"id,nombre\r\n1,Python\r\n2,Rust\r\n"),
+    (b"id,nombre\r\n1,Python\r\n2,Rust\r", b"id,nombre\r\n1,Python\r\n2,Rust\r\n"),
+    (b'id,nombre\r\n1,Python\r\n2,"C, C++"', b'id,nombre\r\n1,Python\r\n2,"C, C++"\r\n'),
+    (b"id,nombre\r\n1,Python\r\n2", b"id,nombre\r\n1,Python\r\n"),
+    (b'id,nombre\r\n1,Python\r\n2,"Objective', b"id,nombre\r\n1,Python\r\n"),
+    (b'id,nombre\r\n1,"Visual\r\nBasic"\r\n2,"Objective\r\nC', b'id,nombre\r\n1,"Visual\r\nBasic"\r\n'),
+    (b"id,nombre", b"id,nombre\r\n"),
+])
+def test_repair_tail_only_drops_rows_cut_off_mid_write(cache_dir, content, repaired):
+    (cache_dir / "tecnologia.csv").write_bytes(content)
+    cache_store.repair_tail("tecnologia")
+    assert (cache_dir / "tecnologia.csv").read_bytes() == repaired
+
+
+def test_write_rows_recovers_a_parquet_table_moved_aside(cache_dir, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(cache_store, "CACHE_FORMAT", "parquet")
+    fields = ["id", "titulo"]
+    cache_store.write_rows("obra", fields, [{"id": 1, "titulo": "old"}])
+
+    # crash between moving the old table aside and renaming the new one in
+    replace = cache_store.os.replace
+    def crash_on_swap(src, dst):
+        if src.endswith(".tmp"):
+            raise KeyboardInterrupt
+        replace(src, dst)
+    monkeypatch.setattr(cache_store.os, "replace", crash_on_swap)
+    with pytest.raises(KeyboardInterrupt):
+        cache_store.write_rows("obra", fields, [{"id": 1, "titulo": "new"}])
+    monkeypatch.setattr(cache_store.os, "replace", replace)
+    assert not cache_store.table_exists("obra")
+
+    cache_store.recover_tables()
+    assert list(cache_store.read_rows("obra")) == [{"id": 1, "titulo": "old"}]
+    cache_store.write_rows("obra", fields, [{"id": 1, "titulo": "new"}])
+    assert list(cache_store.read_rows("obra")) == [{"id": 1, "titulo": "new"}]
+    assert sorted(p.name for p in cache_dir.iterdir()) == ["obra.parquet"]
@@ -0,0 +1,113 @@
+import sys
+
+import pytest
+
+import cache_store
+import csv_to_sql
+import create_db
+
+OBRA_FIELDS = ["id", "doi", "direccion_fuente", "titulo", "tematica_id"]
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """Connection parameters of a throwaway PostgreSQL started with pgserver."""
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg2")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"))
+    yield {"host": str(server.pgdata), "user": "postgres", "database": "postgres"}
+    server.cleanup()
+
+
+@pytest.fixture
+def connection(database, tmp_path, monkeypatch):
+    import psycopg2
+    monkeypatch.setattr(cache_store, "CACHE_DIR", str(tmp_path))
+    connection = psycopg2.connect(**database)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+        cursor.execute(create_db.sql_script)
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def obra(id, title, doi=None):
+    return {"id": id, "doi": doi or f"https://doi.org/10.1/{id}", "direccion_fuente": f"http://x/{id}.pdf",
+            "titulo": title, "tematica_id": ""}
+
+
+def sync(connection, rows):
+    cache_store.write_rows("obra", OBRA_FIELDS, rows)
+    csv_to_sql.load_table(connection, "obra", sync=True)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, doi, titulo FROM obra ORDER BY id")
+        return cursor.fetchall()
+
+
+def test_sync_sends_changed_rows_and_skips_unique_conflicts(connection, capsys):
+    rows = [obra(i, f"Title {i}") for i in range(1, 5)]
+    sync(connection, rows)
+    assert "4 rows sent (0 unchanged), 4 upserted" in capsys.readouterr().out
+
+    rows[1] = obra(2, "Changed 2")
+    rows[2] = obra(3, "Title 3", doi=rows[3]["doi"])   # would take obra 4's doi
+    rows.append(obra(1, "Last copy of 1"))             # same id twice: the last one wins
+    stored = sync(connection, rows)
+    out = capsys.readouterr().out
+    assert "3 rows sent (1 unchanged), 2 upserted" in out
+    assert "1 rows skipped" in out
+    assert stored == [
+        (1, "https://doi.org/10.1/1", "Last copy of 1"),
+        (2, "https://doi.org/10.1/2", "Changed 2"),
+        (3, "https://doi.org/10.1/3", "Title 3"),
+        (4, "https://doi.org/10.1/4", "Title 4"),
+    ]
+
+    # the skipped row has no load_state hash, so it is tried again; the rest are unchanged
+    sync(connection, rows)
+    assert "1 rows sent (3 unchanged), 0 upserted" in capsys.readouterr().out
+
+
+class FakeConnection:
+    def __init__(self):
+        self.rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakePool:
+    def __init__(self, *args, **kwargs):
+        self.connection = FakeConnection()
+
+    def getconn(self):
+        return self.connection
+
+    def putconn(self, connection):
+        pass
+
+    def closeall(self):
+        pass
+
+
+def test_failed_restore_does_not_hide_the_load_error(monkeypatch, tmp_path, capsys):
+    pools = []
+    monkeypatch.setattr(cache_store, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(csv_to_sql, "ThreadedConnectionPool", lambda *a, **kw: pools.append(FakePool()) or pools[-1])
+    monkeypatch.setattr(csv_to_sql, "drop_constraints", lambda connection, tables: ([], []))
+
+    def load_tables(pool, deps, workers, sync):
+        raise RuntimeError("load failed")
+
+    def restore_constraints(connection, foreign_keys, indexes):
+        raise RuntimeError("orphan rows in obra_tecnologia")
+
+    monkeypatch.setattr(csv_to_sql, "load_tables", load_tables)
+    monkeypatch.setattr(csv_to_sql, "restore_constraints", restore_constraints)
+    monkeypatch.setattr(sys, "argv", ["csv_to_sql.py", "--defer-constraints"])
+
+    with pytest.raises(RuntimeError, match="load failed"):
+        csv_to_sql.main()
+    assert pools[0].connection.rolled_back
+    assert "orphan rows in obra_tecnologia" in capsys.readouterr().out
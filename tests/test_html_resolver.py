@@ -0,0 +1,28 @@
+import pytest
+
+import html_resolver
+
+PAGES = [
+    ('<html><head><title>Article</title><meta name="citation_pdf_url" content="/files/a.pdf"></head>'
+     '<body><a href="other.pdf">PDF</a><script>var x = "not found";</script></body></html>'),
+    '<html><body><h1>Error 404</h1><p>Page not found</p></body></html>',
+    ('<html><body><div class="textLayer"><span>We used </span><span>Python<br>and C</span></div>'
+     '<p>Footer</p><a href="/download/b.pdf">Download</a></body></html>'),
+]
+
+
+@pytest.mark.parametrize("html", PAGES)
+def test_stdlib_fallback_matches_lxml(html, monkeypatch):
+    pytest.importorskip("lxml")
+    expected = html_resolver.resolve(html, "https://example.org/article/1")
+    monkeypatch.setattr(html_resolver, "etree", None)
+    result = html_resolver.resolve(html, "https://example.org/article/1")
+    assert {k: v for k, v in result.items() if k != "seconds"} == {k: v for k, v in expected.items() if k != "seconds"}
+
+
+def test_resolve_reads_landing_pages():
+    first, error, rendered = (html_resolver.resolve(html, "https://example.org/article/1") for html in PAGES)
+    assert first["pdf_url"] == "https://example.org/files/a.pdf" and not first["error_page"]
+    assert error["error_page"]
+    assert rendered["text"] == "We used Python and C"
+    assert rendered["pdf_url"] == "https://example.org/download/b.pdf"
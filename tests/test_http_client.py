@@ -0,0 +1,58 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import http_client
+
+
+class SlowBody(BaseHTTPRequestHandler):
+    """Sends its body in pieces and records how many responses are being streamed at once."""
+    lock = threading.Lock()
+    streaming = peak = 0
+
+    def do_GET(self):
+        cls = type(self)
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        with cls.lock:
+            cls.streaming += 1
+            cls.peak = max(cls.peak, cls.streaming)
+        self.wfile.write(b"ab")
+        self.wfile.flush()
+        time.sleep(0.1)
+        with cls.lock:
+            cls.streaming -= 1  # before the last piece: the client cannot finish reading earlier
+        self.wfile.write(b"cd")
+
+
+@pytest.fixture
+def host(stand_in_server):
+    host = stand_in_server.removeprefix("http://")
+    http_client.configure_host(host, 1000, 2)
+    SlowBody.peak = 0
+    return host
+
+
+@pytest.mark.parametrize("stand_in_server", [SlowBody], indirect=True)
+def test_streamed_responses_hold_the_host_slot_until_closed(host):
+    def fetch():
+        response = http_client.get(f"http://{host}/doc.pdf", stream=True)
+        try:
+            assert b"".join(response.iter_content(2)) == b"abcd"
+        finally:
+            response.close()
+
+    threads = [threading.Thread(target=fetch) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert SlowBody.peak <= 2
+
+    semaphore = http_client.get_client(f"http://{host}/").semaphore
+    assert semaphore.acquire(blocking=False) and semaphore.acquire(blocking=False)
+    semaphore.release()
+    semaphore.release()
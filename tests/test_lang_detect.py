@@ -0,0 +1,30 @@
+from lang_detect import LanguageDetector
+
+NAMES = {"Python", "Java", "C", "C++", "Go"}
+
+
+def test_repeated_unambiguous_names_are_confident():
+    detection = LanguageDetector(NAMES).detect("The tool is written in Python. Python bindings call the Java core.")
+    assert detection["programming_languages"] == ["Python"]
+    assert detection["uncertain"] == ["Java"]
+    assert not detection["confident"]
+
+    detection = LanguageDetector(NAMES).detect("Python here, Python there.")
+    assert detection == {"programming_languages": ["Python"], "uncertain": [], "confident": True}
+
+
+def test_text_without_known_names_goes_to_the_llm():
+    detection = LanguageDetector(NAMES).detect("The service is implemented in Elixir on the BEAM virtual machine.")
+    assert detection["programming_languages"] == []
+    assert not detection["confident"]
+
+
+
+def test_tool_names_from_the_vocabulary_are_never_confident():
+    names = NAMES | {"PRISM", "gnuplot", "SPSS", "LIFE"}
+    text = ("Models were checked with the PRISM model checker. PRISM results were plotted with gnuplot; "
+            "gnuplot scripts and SPSS, SPSS exports are included. The checker is written in Java and Java.")
+    detection = LanguageDetector(names).detect(text)
+    assert detection["programming_languages"] == ["Java"]
+    assert {"PRISM", "gnuplot", "SPSS"} <= set(detection["uncertain"])
+    assert not detection["confident"]
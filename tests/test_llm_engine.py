@@ -0,0 +1,125 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import llm_engine
+from llm_engine import AnalysisEngine, parse_languages
+
+
+@pytest.mark.parametrize("raw, languages", [
+    ('{"programming_languages": ["Python", "C", "Python"]}', ["C", "Python"]),
+    ('Sure: {"programming_languages": []} done', []),
+    ("no JSON here", []),
+])
+def test_parse_languages(raw, languages):
+    assert parse_languages(raw) == {"programming_languages": languages}
+
+
+@pytest.mark.parametrize("raw", [
+    '{"programming_languages": "Python"}',
+    '{"programming_languages": null}',
+    '{"programming_languages": [{"name": "Python"}]}',
+    '{"programming_languages": ["Python"}',
+])
+def test_parse_languages_rejects_malformed_answers(raw):
+    result = parse_languages(raw)
+    assert result["programming_languages"] == []
+    assert "error" in result
+
+
+class OllamaStandIn(BaseHTTPRequestHandler):
+    """
+    /api/generate answering with the model output queued for each prompt:
+    None sends a 500 and bytes are sent as the raw body.
+    """
+    answers = {}
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+            answer = cls.answers[body["prompt"]].pop(0)
+        threading.Event().wait(0.05)
+        with cls.lock:
+            cls.in_flight -= 1
+        if answer is None:
+            self.send_response(500)
+            self.end_headers()
+            return
+        payload = answer if isinstance(answer, bytes) else json.dumps({"response": answer}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+uses_ollama = pytest.mark.parametrize("stand_in_server", [OllamaStandIn], indirect=True)
+
+
+@pytest.fixture
+def engine(stand_in_server, monkeypatch):
+    monkeypatch.setattr(llm_engine, "OLLAMA_URL", stand_in_server)
+    monkeypatch.setattr(llm_engine, "backoff_delay", lambda attempt: 0)
+    OllamaStandIn.answers, OllamaStandIn.peak = {}, 0
+    engine = AnalysisEngine("ollama", "stub", render=lambda text: text, max_in_flight=2, max_retries=2)
+    yield engine
+    engine.close()
+
+
+@uses_ollama
+def test_engine_retries_and_reports_bad_answers(engine):
+    OllamaStandIn.answers = {
+        "ok": ['{"programming_languages": ["Rust"]}'],
+        "flaky": [None, '{"programming_languages": ["Go"]}'],
+        "string": ['{"programming_languages": "Python"}', '{"programming_languages": "Python"}'],
+    }
+    assert engine.analyze("ok") == {"programming_languages": ["Rust"]}
+    assert engine.analyze("flaky") == {"programming_languages": ["Go"]}
+    result = engine.analyze("string")
+    assert result["programming_languages"] == [] and "error" in result
+
+
+@uses_ollama
+def test_engine_caps_requests_in_flight(engine):
+    texts = {i: f"doc {i}" for i in range(8)}
+    OllamaStandIn.answers = {text: ['{"programming_languages": ["C"]}'] for text in texts.values()}
+    results = engine.analyze_many(texts)
+    assert results == {i: {"programming_languages": ["C"]} for i in texts}
+    assert OllamaStandIn.peak <= 2
+
+
+@uses_ollama
+def test_engine_survives_non_json_bodies(engine):
+    OllamaStandIn.answers = {
+        "html": [b"<html>502 Bad Gateway</html>", b"<html>502 Bad Gateway</html>"],
+        "list": [b"[]", '{"programming_languages": ["Go"]}'],
+        "ok": ['{"programming_languages": ["C"]}'],
+    }
+    results = engine.analyze_many({1: "html", 2: "list", 3: "ok"})
+    assert results[1]["programming_languages"] == [] and "error" in results[1]
+    assert results[2] == {"programming_languages": ["Go"]}
+    assert results[3] == {"programming_languages": ["C"]}
+
+
+@uses_ollama
+def test_failed_batch_falls_back_to_online(engine, monkeypatch):
+    async def broken_batch(texts, poll_seconds):
+        raise RuntimeError("batch upload rejected")
+
+    async def answer(text):
+        return '{"programming_languages": ["Rust"]}'
+
+    monkeypatch.setattr(engine, "batch", broken_batch)
+    monkeypatch.setattr(engine, "request", answer)
+    engine.backend = "gpt"
+    try:
+        assert engine.analyze_many({1: "doc", 2: "other"}) == {key: {"programming_languages": ["Rust"]} for key in (1, 2)}
+    finally:
+        engine.backend = "ollama"  # close() picks the client's close method by backend
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import process_pdf
+import text_prep
+from analysis_cache import AnalysisCache
+
+
+class StubEngine:
+    """Stands in for AnalysisEngine: answers every text with Python and counts the calls."""
+    def __init__(self):
+        self.texts = []
+        self.lock = threading.Lock()
+
+    def analyze(self, text):
+        with self.lock:
+            self.texts.append(text)
+        return {"programming_languages": ["Python"]}
+
+
+def test_run_pipeline_sends_each_text_to_the_backend(monkeypatch):
+    texts = {f"http://x/{i}.pdf": f"Article {i} implemented in an unnamed language." for i in range(5)}
+    monkeypatch.setattr(process_pdf, "fetch_text",
+                        lambda pdf_url, doi=None, **kwargs: (texts.get(pdf_url), pdf_url))
+    obras = [(i, url, None) for i, url in enumerate(texts)] + [(99, "http://x/missing.pdf", None)]
+    engine = StubEngine()
+    results = {}
+
+    process_pdf.run_pipeline(obras, lambda obra_id, text, url, result: results.setdefault(obra_id, result),
+                             download_workers=2, extract_workers=1, analysis_workers=2,
+                             prefilter=False, token_budget=0, engine=engine)
+
+    assert len(engine.texts) == len(texts)
+    assert results[99] is None
+    for obra_id in range(5):
+        assert results[obra_id] == {"programming_languages": ["Python"]}
+
+
+def test_analysis_cache_is_keyed_on_the_full_text_and_budget(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path / "analysis.sqlite"))
+    engine = StubEngine()
+    head = "Introduction. " * 200
+    article = lambda tail: head + ("Python was used here. " * 300) + tail
+    analyze = lambda text, budget: process_pdf.analyze(text, cache=cache, prefilter=False,
+                                                       token_budget=budget, engine=engine)
+
+    # two articles whose reduced texts could coincide still get their own entries
+    analyze(article("Appendix A."), 200)
+    analyze(article("Appendix B."), 200)
+    assert len(engine.texts) == 2
+
+    # a hit skips the reduction entirely
+    monkeypatch.setattr(text_prep, "reduce_text", lambda *args: pytest.fail("reduced on a cache hit"))
+    assert analyze(article("Appendix A."), 200) == {"programming_languages": ["Python"]}
+    monkeypatch.undo()
+
+    analyze(article("Appendix A."), 400)
+    monkeypatch.setattr(text_prep, "REDUCER_VERSION", text_prep.REDUCER_VERSION + 1)
+    analyze(article("Appendix A."), 200)
+    assert len(engine.texts) == 4
@@ -0,0 +1,34 @@
+import requests
+
+import http_client
+from source_cache import SourceCache, HOST_FAILURE_THRESHOLD
+
+
+def test_content_failures_never_open_the_host_breaker(tmp_path):
+    sources = SourceCache(str(tmp_path / "sources.sqlite"))
+    for i in range(HOST_FAILURE_THRESHOLD + 2):
+        sources.mark_failed(f"https://publisher.example/landing/{i}", "html without text or pdf link")
+    assert sources.is_dead("https://publisher.example/landing/0")
+    assert not sources.is_dead("https://publisher.example/landing/new")
+
+
+def test_transport_failures_open_the_host_breaker(tmp_path):
+    sources = SourceCache(str(tmp_path / "sources.sqlite"))
+    for i in range(HOST_FAILURE_THRESHOLD):
+        assert not sources.is_dead("https://down.example/new")
+        sources.mark_failed(f"https://down.example/{i}.pdf", "error: timed out", transport=True)
+    assert sources.is_dead("https://down.example/new")
+
+
+def test_is_transport_error():
+    def http_error(status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.HTTPError(response=response)
+
+    assert http_client.is_transport_error(requests.ConnectionError())
+    assert http_client.is_transport_error(requests.Timeout())
+    assert http_client.is_transport_error(http_error(503))
+    assert http_client.is_transport_error(http_error(429))
+    assert not http_client.is_transport_error(http_error(403))
+    assert not http_client.is_transport_error(ValueError("PDF larger than 50 MB"))
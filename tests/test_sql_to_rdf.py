@@ -0,0 +1,125 @@
+import re
+import sqlite3
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from rdflib import Graph
+
+import sql_to_rdf
+from export_state import ExportState
+
+SCHEMA = """
+    CREATE TABLE tematica (id INTEGER PRIMARY KEY, nombre_campo TEXT);
+    CREATE TABLE tematica_contenida (id INTEGER PRIMARY KEY, tematica_padre_id INTEGER, tematica_hijo_id INTEGER);
+    CREATE TABLE tecnologia (id INTEGER PRIMARY KEY, nombre TEXT, tipo TEXT, version TEXT);
+    CREATE TABLE obra (id INTEGER PRIMARY KEY, doi TEXT, direccion_fuente TEXT, titulo TEXT, abstract TEXT,
+                       fecha_publicacion TEXT, idioma TEXT, num_citas INTEGER, fwci REAL, tematica_id INTEGER);
+    CREATE TABLE obra_tecnologia (id INTEGER PRIMARY KEY, obra_id INTEGER, tecnologia_id INTEGER);
+    INSERT INTO tematica VALUES (1, 'Computer Science'), (2, 'Software'), (3, 'Databases');
+    INSERT INTO tematica_contenida VALUES (1, 1, 2), (2, 1, 2), (3, 1, 3);
+    INSERT INTO tecnologia VALUES (1, 'Python', NULL, NULL), (2, 'Rust', NULL, NULL);
+    INSERT INTO obra VALUES (1, 'https://doi.org/10.1/1', 'http://x/1.pdf', 'First', 'An "abstract"
+over two lines', '2020-01-01', 'en', 3, 1.5, 2),
+                            (2, 'https://doi.org/10.1/2', NULL, 'Second', NULL, NULL, 'en', 0, 0.0, 3);
+    INSERT INTO obra_tecnologia VALUES (1, 1, 1), (2, 1, 2), (3, 2, 1);
+"""
+
+
+class SqliteCursor:
+    """The part of a psycopg2 cursor the exporters use, over SQLite."""
+    def __init__(self, db):
+        self.cursor = db.cursor()
+        self.rows = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.close()
+
+    def execute(self, query, params=None):
+        if query.strip() == "SELECT now()":
+            self.rows = iter([(datetime.now(timezone.utc),)])
+        else:
+            self.rows = iter(self.cursor.execute(query, params or ()).fetchall())
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def __iter__(self):
+        return self.rows
+
+
+class SqliteConnection:
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(SCHEMA)
+
+    def cursor(self, name=None):
+        return SqliteCursor(self.db)
+
+
+class GraphStoreStandIn(BaseHTTPRequestHandler):
+    """SPARQL Update endpoint that applies DELETE DATA / INSERT DATA, in order, to an rdflib graph."""
+    graph = Graph()
+    updates = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        type(self).updates.append(body)
+        for operation, block in re.findall(r"(DELETE|INSERT) DATA \{\n(.*?)\n\}(?: ;\n|$)", body, re.S):
+            for triple in Graph().parse(data=block, format="turtle"):
+                (self.graph.remove if operation == "DELETE" else self.graph.add)(triple)
+        self.send_response(204)
+        self.end_headers()
+
+
+@pytest.fixture
+def endpoint(stand_in_server):
+    GraphStoreStandIn.graph, GraphStoreStandIn.updates = Graph(), []
+    return f"{stand_in_server}/repositories/openalex/statements"
+
+
+def full_export(conn, tmp_path):
+    path = tmp_path / "full.nt"
+    sql_to_rdf.export_graph(conn, str(path), "nt")
+    return set(Graph().parse(str(path), format="nt"))
+
+
+@pytest.mark.parametrize("stand_in_server", [GraphStoreStandIn], indirect=True)
+def test_incremental_push_matches_a_full_export(endpoint, tmp_path):
+    conn = SqliteConnection()
+    state = ExportState(str(tmp_path / "state.sqlite"))
+
+    def push():
+        sql_to_rdf.export_incremental(conn, sql_to_rdf.graph_store_push(endpoint), state, batch_triples=1, full=True)
+        assert set(GraphStoreStandIn.graph) == full_export(conn, tmp_path)
+
+    push()
+    updates = len(GraphStoreStandIn.updates)
+    push()
+    assert len(GraphStoreStandIn.updates) == updates  # nothing changed, nothing sent
+
+    # a duplicate pair loses one of its rows: the other still asserts the triples
+    conn.db.execute("DELETE FROM tematica_contenida WHERE id = 1")
+    push()
+    # the pair moves to a new id, inserted in one batch and deleted from the old id in a later one
+    conn.db.execute("DELETE FROM tematica_contenida WHERE id = 2")
+    conn.db.execute("INSERT INTO tematica_contenida VALUES (4, 1, 2)")
+    push()
+
+    conn.db.execute("UPDATE obra SET titulo = 'First, revised', abstract = NULL WHERE id = 1")
+    conn.db.execute("DELETE FROM obra_tecnologia WHERE id = 2")
+    conn.db.execute("DELETE FROM tematica_contenida")
+    push()
+
+
+def test_state_written_before_refs_is_recounted(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    state = ExportState(path)
+    triples = ["<a> <b> <c> ."]
+    state.save([("tematica_contenida", 1, triples), ("tematica_contenida", 2, triples)])
+    state.db.execute("DELETE FROM triple_refs")
+    state.db.commit()
+    assert ExportState(path).refs(triples) == {triples[0]: 2}
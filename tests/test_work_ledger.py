@@ -0,0 +1,24 @@
+from work_ledger import WorkLedger, ANALYZED, FAILED
+
+
+def test_pending_skips_done_obras_and_retries_failed_on_request(tmp_path):
+    ledger = WorkLedger(str(tmp_path / "ledger.sqlite"))
+    obras = [(1, "http://x/1.pdf", "10.1/1"), (2, "http://x/2.pdf", "10.1/2"), (3, "http://x/3.pdf", None)]
+    assert ledger.pending(obras) == obras
+    ledger.mark_analyzed([1])
+    ledger.mark(2, FAILED, "no pdf or text found")
+    assert ledger.pending(obras) == obras[2:]
+    assert ledger.pending(obras, retry_failed=True) == obras[1:]
+    assert ledger.statuses() == {1: ANALYZED, 2: FAILED}
+
+
+def test_renumbered_obras_are_pending_again(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    ledger = WorkLedger(path)
+    ledger.pending([(1, "http://x/1.pdf", "10.1/1")])
+    ledger.mark_analyzed([1])
+
+    # a full harvest gave id 1 to another work
+    rerun = WorkLedger(path)
+    obras = [(1, "http://x/9.pdf", "10.1/9"), (2, "http://x/1.pdf", "10.1/1")]
+    assert rerun.pending(obras) == obras